@@ -1,434 +1,524 @@
 import datetime as dt
+import os
+import threading
 import time
 import logging
 import pandas as pd
 import numpy as np
 
-from cointegration_analysis import estimate_long_run_short_run_relationships, engle_granger_two_step_cointegration_test
-
 from optibook.synchronous_client import Exchange
 
-from math import floor, ceil
-from black_scholes import call_value, put_value, call_delta, put_delta
-from libs import calculate_current_time_to_date
-
-exchange = Exchange()
-exchange.connect()
+from functools import partial
+from math import ceil
+from async_exchange import AsyncExchange
+from cointegration_tracker import PairsTracker
+from execution import SmartExecutor
+from instrument_registry import InstrumentRegistry
+from market_data import MarketDataCache
+from order_gateway import OrderGateway, TokenBucket, QUOTE_PRIORITY
+from order_router import OrderRouter
+from portfolio_greeks import PortfolioGreeks
+from position_ledger import PositionLedger
+from quote_manager import QuoteManager
+from strategy_worker import StrategyWorker
+from option_pricing import times_to_expiry, black_scholes_chain
+from telemetry import InstrumentedExchange, MetricsExporter, Profiler, start_async_logging
+from tick_recorder import TickRecorder
+from volatility_surface import VolatilitySurface
 
+logger = logging.getLogger(__name__)
 logging.getLogger('client').setLevel('ERROR')
 
-def trade_would_breach_position_limit(instrument_id, volume, side, position_limit=300):
-    positions = exchange.get_positions()
-    position_instrument = positions[instrument_id]
-
-    if side == 'bid':
-        return position_instrument + volume > position_limit
-    elif side == 'ask':
-        return position_instrument - volume < -position_limit
-    else:
-        raise Exception(f'''Invalid side provided: {side}, expecting 'bid' or 'ask'.''')
-
-
-def print_positions_and_pnl():
-    positions = exchange.get_positions()
-    pnl = exchange.get_pnl()
-
-    print('Positions:')
-    for instrument_id in positions:
-        print(f'  {instrument_id:10s}: {positions[instrument_id]:4.0f}')
-
-    print(f'\nPnL: {pnl:.2f}')
-
-
-STOCK_IDS = ['ING', 'BAYER', 'SANTANDER']
-volatility = {'ING': 4.0, 'BAYER': 4.0, 'SANTANDER': 3.2}
-
-OPTIONS = [
-    {'id': 'BAY-2022_03_18-050C', 'expiry_date': dt.datetime(2022, 3, 18, 12, 0, 0), 'strike': 50, 'callput': 'call'},
-    {'id': 'BAY-2022_03_18-050P', 'expiry_date': dt.datetime(2022, 3, 18, 12, 0, 0), 'strike': 50, 'callput': 'put'},
-    {'id': 'BAY-2022_03_18-075C', 'expiry_date': dt.datetime(2022, 3, 18, 12, 0, 0), 'strike': 75, 'callput': 'call'},
-    {'id': 'BAY-2022_03_18-075P', 'expiry_date': dt.datetime(2022, 3, 18, 12, 0, 0), 'strike': 75, 'callput': 'put'},
-    {'id': 'BAY-2022_03_18-100C', 'expiry_date': dt.datetime(2022, 3, 18, 12, 0, 0), 'strike': 100, 'callput': 'call'},
-    {'id': 'BAY-2022_03_18-100P', 'expiry_date': dt.datetime(2022, 3, 18, 12, 0, 0), 'strike': 100, 'callput': 'put'},
-    {'id': 'SAN-2022_03_18-040C', 'expiry_date': dt.datetime(2022, 3, 18, 12, 0, 0), 'strike': 40, 'callput': 'call'},
-    {'id': 'SAN-2022_03_18-040P', 'expiry_date': dt.datetime(2022, 3, 18, 12, 0, 0), 'strike': 40, 'callput': 'put'},
-    {'id': 'SAN-2022_03_18-050C', 'expiry_date': dt.datetime(2022, 3, 18, 12, 0, 0), 'strike': 50, 'callput': 'call'},
-    {'id': 'SAN-2022_03_18-050P', 'expiry_date': dt.datetime(2022, 3, 18, 12, 0, 0), 'strike': 50, 'callput': 'put'},
-    {'id': 'SAN-2022_03_18-060C', 'expiry_date': dt.datetime(2022, 3, 18, 12, 0, 0), 'strike': 60, 'callput': 'call'},
-    {'id': 'SAN-2022_03_18-060P', 'expiry_date': dt.datetime(2022, 3, 18, 12, 0, 0), 'strike': 60, 'callput': 'put'},
-    {'id': 'ING-2022_03_18-015C', 'expiry_date': dt.datetime(2022, 3, 18, 12, 0, 0), 'strike': 15, 'callput': 'call'},
-    {'id': 'ING-2022_03_18-015P', 'expiry_date': dt.datetime(2022, 3, 18, 12, 0, 0), 'strike': 15, 'callput': 'put'},
-    {'id': 'ING-2022_03_18-020C', 'expiry_date': dt.datetime(2022, 3, 18, 12, 0, 0), 'strike': 20, 'callput': 'call'},
-    {'id': 'ING-2022_03_18-020P', 'expiry_date': dt.datetime(2022, 3, 18, 12, 0, 0), 'strike': 20, 'callput': 'put'},
-    {'id': 'ING-2022_03_18-025C', 'expiry_date': dt.datetime(2022, 3, 18, 12, 0, 0), 'strike': 25, 'callput': 'call'},
-    {'id': 'ING-2022_03_18-025P', 'expiry_date': dt.datetime(2022, 3, 18, 12, 0, 0), 'strike': 25, 'callput': 'put'},
-]
-
-underlying = {
-    'ING-2022_03_18-015C':'ING',
-    'ING-2022_03_18-015P':'ING',
-    'ING-2022_03_18-020C':'ING',
-    'ING-2022_03_18-020P':'ING',
-    'ING-2022_03_18-025C':'ING',
-    'ING-2022_03_18-025P':'ING',
-    'BAY-2022_03_18-050C':'BAYER',
-    'BAY-2022_03_18-050P':'BAYER',
-    'BAY-2022_03_18-075C':'BAYER',
-    'BAY-2022_03_18-075P':'BAYER',
-    'BAY-2022_03_18-100C':'BAYER',
-    'BAY-2022_03_18-100P':'BAYER',
-    'SAN-2022_03_18-040C':'SANTANDER',
-    'SAN-2022_03_18-040P':'SANTANDER',
-    'SAN-2022_03_18-050C':'SANTANDER',
-    'SAN-2022_03_18-050P':'SANTANDER',
-    'SAN-2022_03_18-060C':'SANTANDER',
-    'SAN-2022_03_18-060P':'SANTANDER',
-}
-
-cointegration_positions = {'BAYER': 0, 'ING': 0, 'SANTANDER': 0}
-
-while True:
-    print(f'')
-    print(f'-----------------------------------------------------------------')
-    print(f'TRADE LOOP ITERATION ENTERED AT {str(dt.datetime.now()):18s} UTC.')
-    print(f'-----------------------------------------------------------------')
-    
-    #########################################
-    #  Implement your main trade loop here  #
-    #########################################
-    
-    print_positions_and_pnl()
-    print(f'')
-    
-    # Determine stock value
-    stocks_price = {}
-    stocks_best_bid_price = {}
-    stocks_best_ask_price = {}
-    for stock_id in STOCK_IDS:
-        stock_order_book = exchange.get_last_price_book(stock_id)
-        if not (stock_order_book and stock_order_book.bids and stock_order_book.asks):
-            print(f'Order book for {stock_id} does not have bids or offers. Skipping iteration.')
-            continue
-        best_bid_price = stock_order_book.bids[0].price
-        best_ask_price = stock_order_book.asks[0].price
-        
-        stocks_price[stock_id] = (best_bid_price + best_ask_price) / 2
-        stocks_best_bid_price[stock_id] = best_bid_price
-        stocks_best_ask_price[stock_id] = best_ask_price
-        print(f'Top level prices for {stock_id}: {best_bid_price:.2f} :: {best_ask_price:.2f}, The stock price for {stock_id}:{stocks_price[stock_id]:.2f}')
-    if len(stocks_price) != len(STOCK_IDS):
-        continue
-
-    options_price = {}
-    options_best_bid_price = {}
-    options_best_ask_price = {}
-    for option in OPTIONS:
-        option_id = option['id']
-        option_order_book = exchange.get_last_price_book(option_id)
-        if not (option_order_book and option_order_book.bids and option_order_book.asks):
-            print(f'Order book for {option_id} does not have bids or offers. Skipping iteration.')
-            continue
-        best_bid_price = option_order_book.bids[0].price
-        best_ask_price = option_order_book.asks[0].price
-    
-        options_price[option_id] = (best_bid_price + best_ask_price) / 2
-        options_best_bid_price[option_id] = best_bid_price
-        options_best_ask_price[option_id] = best_ask_price
-        print(f'Top level prices for {option_id}: {best_bid_price:.2f} :: {best_ask_price:.2f}, The option price for {option_id}:{options_price[option_id]:.2f}')
-    if len(options_price) != len(OPTIONS):
-        continue
-        
-    # Option-quoting strategy
-    
-    # For each option
-    for option in OPTIONS:
-        option_id = option['id']
-        # Print which option we are updating
-        print(f'''Updating option {option['id']} with expiry date {option['expiry_date']}, strike {option['strike']} '''
-              f'''and type {option['callput']}.''')
-
-        # Delete existing orders
-        outstanding = exchange.get_outstanding_orders(option_id)
-        for o in outstanding.values():
-            result = exchange.delete_order(option_id, order_id=o.order_id)
-            print(f"Deleted order id {o.order_id}: {result}")
-            
-        # Calculate option value
-        if option['callput'] == 'call':
-            option_value = call_value(S = stocks_price[underlying[option_id]], K = option['strike'], T = calculate_current_time_to_date(dt.datetime(2022, 3, 18, 12, 0, 0)), r = 0, sigma = volatility[underlying[option_id]])
-        else:
-            option_value = put_value(S = stocks_price[underlying[option_id]], K = option['strike'], T = calculate_current_time_to_date(dt.datetime(2022, 3, 18, 12, 0, 0)), r = 0, sigma = volatility[underlying[option_id]])
-        print(f'The option value of {option_id} is {option_value}')
-            
-        # Calculate desired bid and ask prices
-        desired_bid = floor(option_value / 0.1) * 0.1 - 0.1
-        desired_ask = ceil(option_value / 0.1) * 0.1 + 0.1
-        
-        
-        # Insert limit orders on those prices for a desired volume
-        desired_volume = 30
-        if not trade_would_breach_position_limit(instrument_id = option_id, volume = desired_volume, side = 'bid', position_limit = 150):
-                print(f'''Inserting bid for {option_id}: {desired_volume:.0f} lot(s) at price {desired_bid:.2f}.''')
-                exchange.insert_order(
-                    instrument_id=option_id,
-                    price=desired_bid,
-                    volume= desired_volume,
-                    side='bid',
-                    order_type='limit')
-        else:
-            print(f'''Not inserting {desired_volume:.0f} lot bid for {option_id} to avoid position-limit breach.''')
-        if not trade_would_breach_position_limit(instrument_id = option_id, volume = desired_volume, side = 'ask', position_limit = 150):
-                print(f'''Inserting ask for {option_id}: {desired_volume:.0f} lot(s) at price {desired_ask:.2f}.''')
-                exchange.insert_order(
-                    instrument_id=option_id,
-                    price=desired_ask,
-                    volume= desired_volume,
-                    side='ask',
-                    order_type='limit')
-        else:
-            print(f'''Not inserting {desired_volume:.0f} lot ask for {option_id} to avoid position-limit breach.''')
-            
-        # Wait 1/10th of a second to avoid breaching the exchange frequency limit
-        time.sleep(0.10)
-
-    # Calculate current delta position across all instruments
-    current_delta = {}
-    for option in OPTIONS:
-        option_id = option['id']
-        option_position = exchange.get_positions()[option_id]
-        if option['callput'] == 'call':
-            delta = call_delta(S = stocks_price[underlying[option_id]], K = option['strike'], T = calculate_current_time_to_date(dt.datetime(2022, 3, 18, 12, 0, 0)), r = 0, sigma = volatility[underlying[option_id]]) * option_position
-        else:
-            delta = put_delta(S = stocks_price[underlying[option_id]], K = option['strike'], T = calculate_current_time_to_date(dt.datetime(2022, 3, 18, 12, 0, 0)), r = 0, sigma = volatility[underlying[option_id]]) * option_position
-        current_delta[option_id] = delta
-        
-    for stock_id in STOCK_IDS:
-        stock_position = exchange.get_positions()[stock_id] - cointegration_positions[stock_id]
-        delta = stock_position * 1
-        current_delta[stock_id] = delta
-            
-        
-    # Calculate stocks to buy/sell to become close to delta-neutral
-    hedging_volume = {}
-    for stock_id in STOCK_IDS:
-        hedging_delta = current_delta[stock_id]
-        for option in OPTIONS:
-            option_id = option['id']
-            if underlying[option_id] == stock_id:
-                hedging_delta += current_delta[option_id]
-        hedging_volume[stock_id] = int(hedging_delta)
-    print(f'Stocks required to buy/sell to become close to delta-neutral: ')
-    print(f'{hedging_volume}')
-          
-    # Perform the hedging stock trade by inserting an IOC order on the stock against the current top-of-book
-    for stock_id in STOCK_IDS:
-        volume = 15
-        best_bid_price = stocks_best_ask_price[stock_id]
-        best_ask_price = stocks_best_bid_price[stock_id]
-        while abs(hedging_volume[stock_id]) > 10:
-            if hedging_volume[stock_id] < 0:
-                if not trade_would_breach_position_limit(instrument_id = stock_id, volume = volume, side = 'bid', position_limit = 300):
-                    print(f'''Inserting bid for {stock_id}: {volume:.0f} lot(s) at price {best_bid_price:.2f}.''')
-                    exchange.insert_order(
-                        instrument_id=stock_id,
-                        price=best_bid_price,
-                        volume= volume,
-                        side='bid',
-                        order_type='ioc')
-                    best_bid_price += 0.002
-                    if abs(best_bid_price - stocks_best_ask_price[stock_id]) > 0.1:
-                        break
-                else:
-                    print(f'''Not inserting {volume:.0f} lot ask for {stock_id} to avoid position-limit breach.''')
-                    break
-            else:
-                if not trade_would_breach_position_limit(instrument_id = stock_id, volume = volume, side = 'ask', position_limit = 300):
-                    print(f'''Inserting ask for {stock_id}: {volume:.0f} lot(s) at price {best_ask_price:.2f}.''')
-                    exchange.insert_order(
-                        instrument_id=stock_id,
-                        price=best_ask_price,
-                        volume= volume,
-                        side='ask',
-                        order_type='ioc')
-                    best_ask_price -= 0.002
-                    if abs(best_ask_price - stocks_best_bid_price[stock_id]) > 0.1:
-                        break
-                else:
-                    print(f'''Not inserting {volume:.0f} lot ask for {stock_id} to avoid position-limit breach.''')
-                    break
-            hedging_delta = exchange.get_positions()[stock_id] - cointegration_positions[stock_id]
-            for option in OPTIONS:
-                option_id = option['id']
-                if underlying[option_id] == stock_id:
-                    hedging_delta += current_delta[option_id]
-            hedging_volume[stock_id] = int(hedging_delta)
-            time.sleep(0.10)
-            
-    option_quoter_positions = {}
-    for stock_id in STOCK_IDS:
-        option_quoter_positions[stock_id] = exchange.get_positions()[stock_id] - cointegration_positions[stock_id]
-    
-    
-    
-    
-    # Cointegration strategy
-    
-    Y = stocks_price['BAYER']
-    X = stocks_price['SANTANDER']
-    y = np.log(stocks_price['BAYER'])
-    x = np.log(stocks_price['SANTANDER'])
-    z = y - (- 0.57 + 1.25 * x)
-    
-    # Insert IOC ask orders on stock BAYER if z > 0.001
-    if z > 0.001:
-        y_price = stocks_best_bid_price['BAYER']
-        y_volume = 20
-        if not trade_would_breach_position_limit(instrument_id = 'BAYER', volume = y_volume, side = 'ask', position_limit=50):
-            print(f'''Inserting ask for BAYER: {y_volume:.0f} lot(s) at price {y_price:.2f}.''')
-            exchange.insert_order(
-                instrument_id='BAYER',
-                price=y_price,
-                volume=y_volume,
-                side='ask',
-                order_type='ioc')
-        else:
-            print(f'''Not inserting {y_volume:.0f} lot ask for BAYER to avoid position-limit breach.''')
-        
-            
-    
-    # Insert IOC bid orders on stock BAYER if z < -0.006
-    elif z < -0.006:
-        y_price = stocks_best_ask_price['BAYER']
+
+# Every instrument's reference data comes from this file, with dense integer indices and the chain layout built
+# once at start-up, so adding an expiry or an underlying is a data change. InstrumentRegistry.from_exchange()
+# builds the same registry from the exchange's own instrument list.
+INSTRUMENTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instruments.json')
+REGISTRY = InstrumentRegistry.from_config(INSTRUMENTS_PATH)
+STOCK_IDS = REGISTRY.stock_ids
+OPTION_IDS = REGISTRY.option_ids
+INSTRUMENT_IDS = REGISTRY.instrument_ids
+STOCK_COUNT = REGISTRY.stock_count
+
+# Positions are attributed to the strategy that traded them
+OPTION_QUOTER = 'option_quoter'
+
+# Every order message goes through one gateway that enforces the exchange's message-rate limit
+MESSAGES_PER_SECOND = 20
+# Quote refreshes go out as concurrent batches over this many extra order connections
+ORDER_CONNECTIONS = 4
+
+# The option quoter's delta is hedged only once it leaves a no-trade band that widens with gamma and trading
+# cost, and then back to the band's edge. Hedges, including the pairs trader's second leg, sweep the visible
+# depth in at most HEDGE_MAX_ORDERS IOCs, never further than HEDGE_MAX_SLIPPAGE from the touch.
+HEDGE_RISK_AVERSION = 1e-3
+MIN_HEDGE_BAND = 10
+HEDGE_MAX_SLIPPAGE = 0.1
+HEDGE_MAX_ORDERS = 2
+HEDGE_POSITION_LIMIT = 300
+# A pair counts as hedged while its net position is within this many lots of its first leg
+PAIR_HEDGE_TOLERANCE = 10
+
+# Log-price relationships between stocks, re-estimated online every tick. Pairs listed here start from this
+# (intercept, hedge ratio) estimate; every other pair is traded once it passes the cointegration check.
+COINTEGRATION_PRIORS = {('BAYER', 'SANTANDER'): (-0.57, 1.25)}
+COINTEGRATION_ENTRY_ZSCORE = 2.0
+# Each pair's own position limit in its y leg, on top of the exchange's limit on the total position
+PAIR_POSITION_LIMIT = 50
+# Pairs whose hedge ratio is closer to zero than this are not traded: the x leg would barely hedge the y leg
+MIN_PAIR_HEDGE_RATIO = 0.1
+
+# Where the live session records books, orders and fills
+RECORDING_DIRECTORY = 'recordings'
+# Price levels kept per side of every recorded book; replays must read recordings back with the same depth
+RECORDING_BOOK_LEVELS = 20
+
+# Per-stage and per-exchange-call latency percentiles are appended here; raise LOG_LEVEL to DEBUG for per-tick detail
+METRICS_PATH = 'metrics.jsonl'
+METRICS_INTERVAL = 10.0
+LOG_LEVEL = 'INFO'
+# Seconds between position and PnL reports
+STATUS_INTERVAL = 5.0
+
+
+def connect_exchange():
+    exchange = Exchange()
+    exchange.connect()
+    return exchange
+
+
+def quote_prices(option_values, tick_sizes):
+    # Desired bid and ask one tick outside the value rounded onto the tick grid
+    desired_bids = np.floor(option_values / tick_sizes) * tick_sizes - tick_sizes
+    desired_asks = np.ceil(option_values / tick_sizes) * tick_sizes + tick_sizes
+    return desired_bids, desired_asks
+
+
+def pair_strategy(y_id, x_id):
+    # Each pair is its own strategy in the ledger, so its legs are attributed separately from every other pair
+    return f'pairs:{y_id}~{x_id}'
+
+
+class TradingSession:
+    """All trading state for one run of the strategy against one exchange.
+
+    The live script passes optibook connections and the wall clock and runs each strategy on its own worker
+    thread; the backtest passes a SimulatedExchange together with its simulated clock and steps every
+    strategy in turn with run_iteration(), so the same code replays offline. registry defaults to the instruments
+    in instruments.json.
+    """
+
+    def __init__(self, exchange, feed_exchange, now=dt.datetime.now, clock=time.monotonic, sleep=time.sleep, recorder=None,
+                 profiler=None, async_exchange=None, registry=REGISTRY):
+        # Which instruments are traded, and their reference data; the benchmarks pass larger synthetic chains
+        self.registry = registry
+
+        # Every stage of the loop and every exchange call is timed into latency histograms
+        self.profiler = profiler if profiler is not None else Profiler()
+        exchange = InstrumentedExchange(exchange, self.profiler)
+        feed_exchange = InstrumentedExchange(feed_exchange, self.profiler)
+        self.exchange = exchange
+        self.now = now
+        self.clock = clock
+        self.sleep = sleep
+        self.last_status = None
+        # Arrival time of the newest book each thread last reacted to, for tick-to-order latency
+        self._tick = threading.local()
+        # Instruments whose book was last seen empty or stale, so each change is logged once, not on every read
+        self._unusable_books = set()
+        self._unusable_lock = threading.Lock()
+
+        self.gateway = OrderGateway(exchange, TokenBucket(rate=MESSAGES_PER_SECOND, capacity=MESSAGES_PER_SECOND,
+                                                          clock=clock, sleep=sleep))
+
+        # Positions are tracked locally from fills
+        self.ledger = PositionLedger(exchange, self.registry.instrument_ids, default_strategy=OPTION_QUOTER, clock=clock)
+        self.ledger.seed()
+
+        # Every strategy sends its orders and polls fills through the router, which attributes each order to
+        # the strategy that sent it. With an async exchange, quote refreshes are sent as concurrent batches that
+        # share the gateway's message budget at quote priority, so a waiting hedge still goes first.
+        self.async_exchange = async_exchange
+        if async_exchange is not None:
+            async_exchange.bucket = self.gateway.quote_bucket
+        self.router = OrderRouter(self.gateway, self.ledger, async_exchange)
+
+        # Live option quotes are remembered and diffed instead of being deleted and reinserted every iteration
+        self.quote_manager = QuoteManager(self.router, OPTION_QUOTER)
+        self.quote_manager.cancel_all(self.registry.option_ids)
+        self.ledger.add_listener(self.on_fill)
+
+        # Market data is read from a cache fed from its own connection; each strategy tracks what it has seen
+        self.market_data = MarketDataCache(feed_exchange, self.registry.instrument_ids, clock=clock)
+        self.quoter_seen_sequences = {}
+        self.hedger_seen_sequences = {}
+        self.pairs_seen_sequences = {}
+        self.workers = []
+
+        # Hedges are sent as depth-aware IOCs that report their fill price against the mid
+        self.executor = SmartExecutor(self.router, self.market_data, max_orders=HEDGE_MAX_ORDERS)
+
+        # The option quoter's net delta and gamma per underlying, re-priced by the quoter and moved by fills
+        self.greeks = PortfolioGreeks(self.registry.stock_ids, self.registry.option_ids, self.registry.option_underlying_index)
+        self.ledger.add_listener(self.greeks.on_fill)
+
+        # Online hedge ratios for every stock pair, with a periodic Engle-Granger check run in the background
+        self.pair_tracker = PairsTracker(self.registry.stock_ids, priors=COINTEGRATION_PRIORS)
+        self.open_pairs = set()
+
+        # Volatility smile per underlying, re-fitted every tick from the option mids
+        self.volatility_surface = VolatilitySurface(self.registry.option_underlying_index, self.registry.stock_volatility)
+
+        # Optionally keep every book change and our own orders and fills for research and replay
+        if recorder is not None:
+            self.market_data.add_listener(recorder.on_book)
+            self.gateway.add_listener(recorder.on_order)
+            self.ledger.add_listener(recorder.on_fill)
+
+        # Tick-to-order: from the arrival of the newest book a strategy reacted to until each of its orders goes out
+        self.gateway.add_listener(self.record_tick_to_order)
+
+    def record_tick_to_order(self, kind, instrument_id, order_id, **_):
+        newest_tick = getattr(self._tick, 'newest', None)
+        if kind == 'insert' and newest_tick is not None:
+            self.profiler.record('tick_to_order', 1e9 * (self.clock() - newest_tick))
+
+    def on_fill(self, trade):
+        self.quote_manager.on_fill(trade.order_id, trade.volume)
+
+    def trade_would_breach_position_limit(self, instrument_id, volume, side, position_limit=300):
+        return self.ledger.would_breach(instrument_id, volume, side, position_limit)
+
+    def position_room(self, instrument_id, side, position_limit=HEDGE_POSITION_LIMIT):
+        # Most we can trade on side before the total position reaches the limit
+        position = self.ledger.position(instrument_id)
+        return max(0, int(position_limit - position if side == 'bid' else position_limit + position))
+
+    def print_positions_and_pnl(self):
+        positions = self.ledger.positions()
+        marks = {instrument_id: book.mid for instrument_id, book in self.market_data.snapshot().items()}
+        pnl = self.ledger.pnl(marks)
+
+        logger.info('Positions: %s', ', '.join(f'{instrument_id} {position:.0f}' for instrument_id, position in positions.items()))
+        logger.info('PnL: %.2f', pnl)
+
+    def report_status(self):
+        now = self.clock()
+        if logger.isEnabledFor(logging.INFO) and (self.last_status is None or now - self.last_status >= STATUS_INTERVAL):
+            self.last_status = now
+            self.print_positions_and_pnl()
+
+    def run_iteration(self):
+        # One pass of every strategy in turn on the calling thread; the backtest steps the session this way
+        with self.profiler.stage('iteration'):
+            logger.debug('Trade loop iteration entered at %s UTC.', self.now())
+            self.sync_fills()
+            self.report_status()
+            self.update_quotes()
+            self.update_hedge()
+            self.update_pairs()
+
+            # Send as many queued quote refreshes as the message budget allows
+            with self.profiler.stage('quote_send'):
+                self.router.pump()
+
+    def start_workers(self):
+        """Run the quoter, hedger and pairs trader each on its own thread, all woken by every book change."""
+        self.workers = [
+            StrategyWorker('quoter', self.quoter_step, profiler=self.profiler),
+            StrategyWorker('hedger', self.hedger_step, profiler=self.profiler),
+            StrategyWorker('pairs', self.update_pairs, profiler=self.profiler),
+        ]
+        for worker in self.workers:
+            self.market_data.add_listener(worker.wake)
+            worker.start()
+
+    def stop_workers(self):
+        for worker in self.workers:
+            worker.stop()
+
+    def quoter_step(self):
+        self.update_quotes()
+        with self.profiler.stage('quote_send'):
+            self.router.pump()
+        # Come back as soon as more budget frees up if refreshes are still queued
+        return self.gateway.wait_time() if self.gateway.pending() else None
+
+    def hedger_step(self):
+        self.sync_fills()
+        self.update_hedge()
+
+    def sync_fills(self):
+        # Bring the ledger, and through its listener our live quotes, up to date with fills
+        with self.profiler.stage('fills'):
+            self.router.poll_fills()
+            self.router.maybe_reconcile()
+
+    def read_books(self, seen_sequences, book_snapshot=None):
+        """Mask of the instruments changed since seen_sequences (updated in place), then best bid and best ask
+        arrays over every instrument in registry order, NaN where the book is empty or stale."""
+        with self.profiler.stage('book_fetch'):
+            if book_snapshot is None:
+                book_snapshot = self.market_data.snapshot()
+            changed_books = self.market_data.changed_since(book_snapshot, seen_sequences)
+        if changed_books:
+            self._tick.newest = max(book_snapshot[instrument_id].received_at for instrument_id in changed_books)
+
+        now = self.clock()
+        best_bids, best_asks = self.registry.top_of_book(book_snapshot, lambda book: self.market_data.is_fresh(book, now))
+        self.log_unusable_books(np.flatnonzero(np.isnan(best_bids)))
+        if logger.isEnabledFor(logging.DEBUG):
+            for instrument_id, best_bid, best_ask in zip(self.registry.instrument_ids, best_bids, best_asks):
+                logger.debug('Top level prices for %s: %.2f :: %.2f', instrument_id, best_bid, best_ask)
+        return self.registry.mask(changed_books), best_bids, best_asks
+
+    def log_unusable_books(self, unusable_indices):
+        unusable = {self.registry.instrument_ids[instrument_index] for instrument_index in unusable_indices}
+        with self._unusable_lock:
+            if unusable == self._unusable_books:
+                return
+            went_bad = unusable - self._unusable_books
+            recovered = self._unusable_books - unusable
+            self._unusable_books = unusable
+        for instrument_id in sorted(went_bad):
+            logger.info('Order book for %s is empty or stale.', instrument_id)
+        for instrument_id in sorted(recovered):
+            logger.info('Order book for %s is usable again.', instrument_id)
+
+    def update_quotes(self):
+        registry = self.registry
+        book_snapshot = self.market_data.snapshot()
+        changed, best_bids, best_asks = self.read_books(self.quoter_seen_sequences, book_snapshot)
+        stock_mids = (best_bids[:registry.stock_count] + best_asks[:registry.stock_count]) / 2
+
+        # Price the whole chain in one pass, with time-to-expiry computed once per expiry and volatility taken
+        # from the smile implied by the market's option mids
+        with self.profiler.stage('pricing'):
+            option_spots = stock_mids[registry.option_underlying_index]
+            option_times = times_to_expiry(registry.unique_expiries, registry.option_expiry_index, self.now())
+            option_sigmas = self.volatility_surface.update(self.market_option_mids(book_snapshot), option_spots,
+                                                           registry.option_strikes, option_times, registry.option_is_call)
+            option_values, option_deltas, option_gammas, option_vegas = black_scholes_chain(
+                S = option_spots, K = registry.option_strikes, T = option_times, r = 0, sigma = option_sigmas,
+                is_call = registry.option_is_call)
+        # Published for the hedger, which always works from the latest pricing. Fills reach the ledger and then
+        # the greeks' on_fill() under the router lock, so the positions are read under it too: a fill is then
+        # either already in them or still to come through on_fill(), never both.
+        with self.router.lock:
+            option_positions = [self.ledger.position(option_id) for option_id in registry.option_ids]
+            self.greeks.reprice(stock_mids, option_deltas, option_gammas, option_positions)
+
+        # Option-quoting strategy
+        with self.profiler.stage('quote'):
+            self.quote_options(stock_mids, changed, option_values)
+
+    def market_option_mids(self, book_snapshot):
+        # Our quotes sit inside the market spread, so the books are mostly our own touch; fitting the smile to
+        # those mids would only echo back the volatility we quoted with. Mids are taken from everyone else's
+        # orders, NaN where that leaves a side empty or the book is stale.
+        now = self.clock()
+        mids = np.full(self.registry.option_count, np.nan)
+        for option_index, option_id in enumerate(self.registry.option_ids):
+            book = book_snapshot[option_id]
+            if not self.market_data.is_fresh(book, now):
+                continue
+            own_orders = [(side, live.price, live.volume) for side in ('bid', 'ask')
+                          for live in (self.quote_manager.live_quote(option_id, side),) if live is not None]
+            market_mid = book.without_orders(own_orders).mid
+            if market_mid is not None:
+                mids[option_index] = market_mid
+        return mids
+
+    def update_hedge(self):
+        # Delta hedging of the option quoter's position
+        if not self.greeks.priced:
+            return
+        book_snapshot = self.market_data.snapshot()
+        _, best_bids, best_asks = self.read_books(self.hedger_seen_sequences, book_snapshot)
+        with self.profiler.stage('delta_hedge'):
+            self.hedge_delta(best_bids[:self.registry.stock_count], best_asks[:self.registry.stock_count], book_snapshot)
+
+    def update_pairs(self):
+        # Cointegration strategy across every stock pair, traded only where both legs have a usable book
+        book_snapshot = self.market_data.snapshot()
+        changed, best_bids, best_asks = self.read_books(self.pairs_seen_sequences, book_snapshot)
+        stock_bids = best_bids[:self.registry.stock_count]
+        stock_asks = best_asks[:self.registry.stock_count]
+        with self.profiler.stage('pairs'):
+            if changed[:self.registry.stock_count].any():
+                self.pair_tracker.update((stock_bids + stock_asks) / 2)
+            self.trade_pairs(stock_bids, stock_asks, book_snapshot)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('option_quoter_positions: %s', self.ledger.strategy_positions(OPTION_QUOTER, self.registry.stock_ids))
+            for k in sorted(self.open_pairs):
+                y_id, x_id = self.pair_tracker.pairs[k]
+                logger.debug('cointegration_positions %s ~ %s: %s', y_id, x_id, self.ledger.strategy_positions(pair_strategy(y_id, x_id), [y_id, x_id]))
+
+    def quote_options(self, stock_mids, changed, option_values):
+        # Only requote options whose underlying is priced and whose own or underlying book moved
+        registry = self.registry
+        stock_count = registry.stock_count
+        underlying_index = registry.option_underlying_index
+        requote = np.isfinite(stock_mids)[underlying_index] & (changed[stock_count:] | changed[:stock_count][underlying_index])
+        desired_bids, desired_asks = quote_prices(option_values, registry.tick_sizes[stock_count:])
+
+        quotes = []
+        for option_index in np.flatnonzero(requote):
+            option = registry.option(option_index)
+            option_id = option.instrument_id
+            logger.debug('Updating option %s with expiry date %s, strike %s and type %s, value %s.',
+                         option_id, option.expiry, option.strike, option.callput, option_values[option_index])
+            desired_bid = float(desired_bids[option_index])
+            desired_ask = float(desired_asks[option_index])
+
+            # Pull a side instead of quoting it if a fill there could breach the position limit
+            desired_volume = 30
+            if self.trade_would_breach_position_limit(instrument_id = option_id, volume = desired_volume, side = 'bid', position_limit = 150):
+                logger.info('Not quoting %.0f lot bid for %s to avoid position-limit breach.', desired_volume, option_id)
+                desired_bid = None
+            if self.trade_would_breach_position_limit(instrument_id = option_id, volume = desired_volume, side = 'ask', position_limit = 150):
+                logger.info('Not quoting %.0f lot ask for %s to avoid position-limit breach.', desired_volume, option_id)
+                desired_ask = None
+
+            quotes.append((option_id, desired_bid, desired_ask, desired_volume))
+
+        if self.async_exchange is not None:
+            # Every cancel, amend and insert of this refresh is in flight at once and acknowledged together
+            self.quote_manager.update_all(quotes)
+            return
+        for quote in quotes:
+            # Queue the quote refresh behind any hedges; only the latest desired quote per option is sent
+            self.gateway.submit(quote[0], QUOTE_PRIORITY, partial(self.quote_manager.update, *quote))
+
+    def hedge_delta(self, stock_bids, stock_asks, book_snapshot):
+        stock_positions = np.array([self.ledger.strategy_position(OPTION_QUOTER, stock_id) for stock_id in self.registry.stock_ids])
+        net_delta = self.greeks.net_delta((stock_bids + stock_asks) / 2, stock_positions)
+        bands = self.greeks.hedge_band((stock_asks - stock_bids) / 2, HEDGE_RISK_AVERSION, MIN_HEDGE_BAND)
+        logger.debug('Net delta per underlying: %s, hedge bands: %s', net_delta, bands)
+
+        # Unpriced underlyings have a NaN delta and never cross their band
+        for stock_index in np.flatnonzero(np.abs(net_delta) > bands):
+            stock_id = self.registry.stock_ids[stock_index]
+            side = 'ask' if net_delta[stock_index] > 0 else 'bid'
+            # Back to the edge of the band, as far as the position limit allows
+            volume = int(ceil(abs(net_delta[stock_index]) - bands[stock_index]))
+            volume = min(volume, self.position_room(stock_id, side))
+            if volume <= 0:
+                logger.info('Not hedging %s: no room under the position limit.', stock_id)
+                continue
+            self.executor.execute(OPTION_QUOTER, stock_id, side, volume, book_snapshot[stock_id], HEDGE_MAX_SLIPPAGE)
+
+    def trade_pairs(self, stock_bids, stock_asks, book_snapshot):
+        # Only pairs with both legs priced and either a new signal or an open spread to look after need any work
+        priced = np.isfinite(stock_bids) & np.isfinite(stock_asks)
+        tradeable = priced[self.pair_tracker.y_index] & priced[self.pair_tracker.x_index]
+        signalled = (self.pair_tracker.cointegrated & (np.abs(self.pair_tracker.zscore) > COINTEGRATION_ENTRY_ZSCORE)
+                     & (np.abs(self.pair_tracker.hedge_ratio) >= MIN_PAIR_HEDGE_RATIO))
+        for k in np.flatnonzero(tradeable & signalled):
+            self.open_pairs.add(int(k))
+        for k in sorted(self.open_pairs):
+            if tradeable[k]:
+                self.trade_pair(k, stock_bids, stock_asks, book_snapshot)
+
+    def trade_pair(self, k, stock_bids, stock_asks, book_snapshot):
+        y_id, x_id = self.pair_tracker.pairs[k]
+        y, x = self.pair_tracker.y_index[k], self.pair_tracker.x_index[k]
+        strategy = pair_strategy(y_id, x_id)
+        Y = (stock_bids[y] + stock_asks[y]) / 2
+        X = (stock_bids[x] + stock_asks[x]) / 2
+        hedge_ratio = self.pair_tracker.hedge_ratio[k]
+        z = self.pair_tracker.zscore[k]
+        logger.debug('%s ~ %s: intercept %.4f, hedge ratio %.4f, z-score %.2f', y_id, x_id, self.pair_tracker.intercept[k], hedge_ratio, z)
+        if abs(hedge_ratio) < MIN_PAIR_HEDGE_RATIO:
+            # The x leg can no longer hedge the spread, so the delta hedger takes over whatever the pair still holds
+            logger.info('Closing %s ~ %s: hedge ratio %.4f is too close to zero to hedge with %s.', y_id, x_id, hedge_ratio, x_id)
+            for stock_id in (y_id, x_id):
+                self.router.reassign(stock_id, strategy, OPTION_QUOTER)
+            self.open_pairs.discard(k)
+            return
+        if not self.pair_tracker.cointegrated[k]:
+            logger.info('%s and %s failed the last cointegration check. Not opening new spreads.', y_id, x_id)
+            z = 0.0
+
+        # Sell the y leg if the spread is rich, buy it if it is cheap
         y_volume = 20
-        if not trade_would_breach_position_limit(instrument_id = 'BAYER', volume = y_volume, side = 'bid', position_limit=50):
-            print(f'''Inserting bid for BAYER: {y_volume:.0f} lot(s) at price {y_price:.2f}.''')
-            exchange.insert_order(
-                instrument_id='BAYER',
-                price=y_price,
-                volume=y_volume,
-                side='bid',
-                order_type='ioc')
-        else:
-            print(f'''Not inserting {y_volume:.0f} lot bid for BAYER to avoid position-limit breach.''')
-
-    # Calculate the current positions of stocks BAYER & SANTANDERS in cointegration strategy
-    
-    y_position = exchange.get_positions()['BAYER'] - option_quoter_positions['BAYER']
-    x_position = exchange.get_positions()['SANTANDER'] - option_quoter_positions['SANTANDER']
-    x_ask_price = stocks_best_bid_price['SANTANDER']
-    x_bid_price = stocks_best_ask_price['SANTANDER']
-    x_volume = 15
-    
-    # Perform the hedging stock trade by inserting IOC orders on stock SANTANDER
-    
-    while abs(y_position + X * x_position / (1.25 * Y)) > 10:
-        if y_position < 0 and x_position >=0:
-            if abs(X * x_position / (1.25 * Y)) > abs(y_position):
-                if not trade_would_breach_position_limit(instrument_id = 'SANTANDER', volume = x_volume, side = 'ask'):
-                    print(f'''Inserting ask for SANTANDER: {x_volume:.0f} lot(s) at price {x_ask_price:.2f}.''')
-                    exchange.insert_order(
-                        instrument_id='SANTANDER',
-                        price=x_ask_price,
-                        volume=x_volume,
-                        side='ask',
-                        order_type='ioc')
-                    x_ask_price -= 0.005
-                    if abs(x_ask_price - stocks_best_bid_price['SANTANDER']) > 0.1:
-                        break
-                else:
-                    print(f'''Not inserting {x_volume:.0f} lot ask for SANTANDER to avoid position-limit breach.''')
-                    break
+        if abs(z) > COINTEGRATION_ENTRY_ZSCORE:
+            side = 'ask' if z > 0 else 'bid'
+            y_price = float(stock_bids[y] if side == 'ask' else stock_asks[y])
+            # The pair's limit is on its own y position, not on whatever other strategies hold in y
+            pair_y_position = self.ledger.strategy_position(strategy, y_id)
+            if side == 'bid':
+                within_pair_limit = pair_y_position + y_volume <= PAIR_POSITION_LIMIT
             else:
-                if not trade_would_breach_position_limit(instrument_id = 'SANTANDER', volume = x_volume, side = 'bid'):
-                    print(f'''Inserting bid for SANTANDER: {x_volume:.0f} lot(s) at price {x_bid_price:.2f}.''')
-                    exchange.insert_order(
-                        instrument_id='SANTANDER',
-                        price=x_bid_price,
-                        volume=x_volume,
-                        side='bid',
-                        order_type='ioc')
-                    x_bid_price += 0.005
-                    if abs(x_bid_price - stocks_best_ask_price['SANTANDER']) > 0.1:
-                        break
-                else:
-                    print(f'''Not inserting {x_volume:.0f} lot bid for SANTANDER to avoid position-limit breach.''')
-                    break
-        elif y_position < 0 and x_position < 0:
-            if not trade_would_breach_position_limit(instrument_id = 'SANTANDER', volume = x_volume, side = 'bid'):
-                print(f'''Inserting bid for SANTANDER: {x_volume:.0f} lot(s) at price {x_bid_price:.2f}.''')
-                exchange.insert_order(
-                    instrument_id='SANTANDER',
-                    price=x_bid_price,
-                    volume=x_volume,
-                    side='bid',
+                within_pair_limit = pair_y_position - y_volume >= -PAIR_POSITION_LIMIT
+            if within_pair_limit and y_volume <= self.position_room(y_id, side):
+                logger.info('Inserting %s for %s: %.0f lot(s) at price %.2f.', side, y_id, y_volume, y_price)
+                self.router.insert_order(strategy,
+                    instrument_id=y_id,
+                    price=y_price,
+                    volume=y_volume,
+                    side=side,
                     order_type='ioc')
-                x_bid_price += 0.005
-                if abs(x_bid_price - stocks_best_ask_price['SANTANDER']) > 0.1:
-                        break
-            else:
-                print(f'''Not inserting {x_volume:.0f} lot bid for SANTANDER to avoid position-limit breach.''')
-                break
-            
-        elif y_position >= 0 and x_position < 0:
-            if abs(X * x_position / (1.25 * Y)) > abs(y_position):
-                if not trade_would_breach_position_limit(instrument_id = 'SANTANDER', volume = x_volume, side = 'bid'):
-                    print(f'''Inserting bid for SANTANDER: {x_volume:.0f} lot(s) at price {x_bid_price:.2f}.''')
-                    exchange.insert_order(
-                        instrument_id='SANTANDER',
-                        price=x_bid_price,
-                        volume=x_volume,
-                        side='bid',
-                        order_type='ioc')
-                    x_bid_price += 0.005
-                    if abs(x_bid_price - stocks_best_ask_price['SANTANDER']) > 0.1:
-                        break
-                else:
-                    print(f'''Not inserting {x_volume:.0f} lot bid for SANTANDER to avoid position-limit breach.''')
-                    break
             else:
-                if not trade_would_breach_position_limit(instrument_id = 'SANTANDER', volume = x_volume, side = 'ask'):
-                    print(f'''Inserting ask for SANTANDER: {x_volume:.0f} lot(s) at price {x_ask_price:.2f}.''')
-                    exchange.insert_order(
-                        instrument_id='SANTANDER',
-                        price=x_ask_price,
-                        volume=x_volume,
-                        side='ask',
-                        order_type='ioc')
-                    x_ask_price -= 0.005
-                    if abs(x_ask_price - stocks_best_bid_price['SANTANDER']) > 0.1:
-                        break
-                else:
-                    print(f'''Not inserting {x_volume:.0f} lot ask for SANTANDER to avoid position-limit breach.''')
-                    break
-        elif y_position >= 0 and x_position >= 0:
-            if not trade_would_breach_position_limit(instrument_id = 'SANTANDER', volume = x_volume, side = 'ask'):
-                print(f'''Inserting ask for SANTANDER: {x_volume:.0f} lot(s) at price {x_ask_price:.2f}.''')
-                exchange.insert_order(
-                    instrument_id='SANTANDER',
-                    price=x_ask_price,
-                    volume=x_volume,
-                    side='ask',
-                    order_type='ioc')
-                x_ask_price -= 0.005
-                if abs(x_ask_price - stocks_best_bid_price['SANTANDER']) > 0.1:
-                        break
+                logger.info('Not inserting %.0f lot %s for %s to avoid position-limit breach.', y_volume, side, y_id)
+
+        # Calculate the current positions of both legs in this pair
+        self.router.poll_fills([y_id])
+        y_position = self.ledger.strategy_position(strategy, y_id)
+        x_position = self.ledger.strategy_position(strategy, x_id)
+
+        # Hedge the y leg by trading the x leg until the spread position is balanced, in units of y: a lot of y is
+        # hedged by hedge_ratio * Y / X lots of x on the other side, or on the same side if the ratio is negative.
+        # Sell x while the pair holds too much of it, buy while it holds too little, in one depth-aware execution
+        imbalance = y_position + X * x_position / (hedge_ratio * Y)
+        if abs(imbalance) > PAIR_HEDGE_TOLERANCE:
+            side = 'ask' if imbalance * hedge_ratio > 0 else 'bid'
+            x_volume = int(round(abs(imbalance * hedge_ratio) * Y / X))
+            room = self.position_room(x_id, side)
+            if x_volume <= 0:
+                logger.info('Not hedging %s ~ %s: an imbalance of %.1f lot(s) of %s is under one lot of %s.',
+                            y_id, x_id, imbalance, y_id, x_id)
+            elif room <= 0:
+                logger.info('Not inserting %s for %s to avoid position-limit breach.', side, x_id)
             else:
-                print(f'''Not inserting {x_volume:.0f} lot ask for SANTANDER to avoid position-limit breach.''')
-                break
-                    
-        y_position = exchange.get_positions()['BAYER'] - option_quoter_positions['BAYER']
-        x_position = exchange.get_positions()['SANTANDER'] - option_quoter_positions['SANTANDER']
-        time.sleep(0.10)
-        
-    for stock_id in STOCK_IDS:
-        if x_position * y_position > 0:
-            cointegration_positions[stock_id] = 0
-        else:
-            cointegration_positions[stock_id] = exchange.get_positions()[stock_id] - option_quoter_positions[stock_id]
-        
-    print(f'option_quoter_positions: {option_quoter_positions}')
-    print(f'cointegration_positions: {cointegration_positions}')
-
-    # Sleep until next iteration
-    print(f'\nSleeping for 3 seconds.')
-    time.sleep(3)
+                self.executor.execute(strategy, x_id, side, min(x_volume, room), book_snapshot[x_id], HEDGE_MAX_SLIPPAGE)
+                y_position = self.ledger.strategy_position(strategy, y_id)
+                x_position = self.ledger.strategy_position(strategy, x_id)
+
+        # Legs held the same way round as the ratio -- the same sign for a positive ratio, opposite signs for a
+        # negative one -- add to each other's risk instead of hedging it, so hand both over to the delta hedger
+        if x_position * y_position * hedge_ratio > 0:
+            for stock_id in (y_id, x_id):
+                self.router.reassign(stock_id, strategy, OPTION_QUOTER)
+        if self.ledger.strategy_position(strategy, y_id) == 0 and self.ledger.strategy_position(strategy, x_id) == 0:
+            self.open_pairs.discard(k)
+
+
+def main():
+    exchange = connect_exchange()
+
+    # Market data is polled on its own connection by a background feed thread
+    feed_exchange = connect_exchange()
+    async_exchange = AsyncExchange(connect_exchange, ORDER_CONNECTIONS)
+
+    # Log records are formatted and written on a background thread
+    start_async_logging(LOG_LEVEL)
+
+    recorder = TickRecorder(RECORDING_DIRECTORY, book_levels=RECORDING_BOOK_LEVELS)
+    recorder.start()
+
+    session = TradingSession(exchange, feed_exchange, recorder=recorder, async_exchange=async_exchange)
+    session.market_data.start()
+    session.pair_tracker.start()
+    MetricsExporter(session.profiler, METRICS_PATH, METRICS_INTERVAL).start()
+
+    # The quoter, hedger and pairs trader run concurrently, so a long hedge never delays requoting
+    session.start_workers()
+    while True:
+        session.report_status()
+        time.sleep(STATUS_INTERVAL)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import asyncio
+import concurrent.futures
+import threading
+from functools import partial
+
+
+class AsyncExchange:
+    """asyncio front end over a pool of synchronous exchange connections.
+
+    connect() is called once per connection and must return a connected client with the
+    optibook.synchronous_client.Exchange interface. Each client is a blocking request/response connection, so a
+    call holds one client for one round trip; with n connections, n calls are in flight at once and a batch of
+    order actions awaited with gather() costs roughly one round trip per n messages instead of one per message.
+
+    The coroutines run on the adapter's own event loop in a background thread. Synchronous code (the strategy
+    workers) drives them with run(); async code can be handed to run() as a whole. When bucket is set, every
+    order message first takes a token from it, so batched traffic shares the gateway's message budget; the
+    trading session passes the gateway's quote_bucket, which lets hedges go first.
+
+    Our trades are reported on the connection that sent the order, so poll_new_trades() asks every connection.
+    """
+
+    def __init__(self, connect, connections=4, bucket=None):
+        self.bucket = bucket
+        self._clients = [connect() for _ in range(connections)]
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=connections, thread_name_prefix='async-exchange')
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='async-exchange-loop', daemon=True)
+        self._thread.start()
+        self._pool, self._client_locks = self.run(self._make_pool())
+
+    async def _make_pool(self):
+        # The queue hands out idle connections; the locks keep a connection polled by poll_new_trades() from
+        # also serving another call at the same time
+        pool = asyncio.Queue()
+        for client in self._clients:
+            pool.put_nowait(client)
+        return pool, {id(client): asyncio.Lock() for client in self._clients}
+
+    def run(self, coroutine, timeout=None):
+        """Run coroutine on the adapter's loop and block the calling thread until it finishes."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(timeout)
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._executor.shutdown()
+        for client in self._clients:
+            client.disconnect()
+
+    async def _acquire(self):
+        # The bucket's own acquire() waits with the bucket's sleep, which keeps simulated clocks in charge of time
+        if self.bucket is not None and not self.bucket.try_acquire():
+            await self._loop.run_in_executor(None, self.bucket.acquire)
+
+    async def _call(self, method, *args, client=None, **kwargs):
+        """Run one blocking client call in the executor, on client if given, otherwise on the next idle connection."""
+        if client is not None:
+            async with self._client_locks[id(client)]:
+                return await self._loop.run_in_executor(self._executor, partial(getattr(client, method), *args, **kwargs))
+        client = await self._pool.get()
+        try:
+            async with self._client_locks[id(client)]:
+                return await self._loop.run_in_executor(self._executor, partial(getattr(client, method), *args, **kwargs))
+        finally:
+            self._pool.put_nowait(client)
+
+    # Order messages
+
+    async def insert_order(self, instrument_id, *, price, volume, side, order_type='limit'):
+        await self._acquire()
+        return await self._call('insert_order', instrument_id, price=price, volume=volume, side=side, order_type=order_type)
+
+    async def delete_order(self, instrument_id, *, order_id):
+        await self._acquire()
+        return await self._call('delete_order', instrument_id, order_id=order_id)
+
+    async def amend_order(self, instrument_id, *, order_id, volume):
+        await self._acquire()
+        return await self._call('amend_order', instrument_id, order_id=order_id, volume=volume)
+
+    @staticmethod
+    async def gather(*actions):
+        """Await a batch of order actions together; results come back in the order the actions were given."""
+        return await asyncio.gather(*actions)
+
+    # Queries
+
+    async def get_outstanding_orders(self, instrument_id):
+        return await self._call('get_outstanding_orders', instrument_id)
+
+    async def get_last_price_book(self, instrument_id):
+        return await self._call('get_last_price_book', instrument_id)
+
+    async def poll_new_trades(self, instrument_id):
+        """New own trades on instrument_id from every connection."""
+        batches = await asyncio.gather(*(self._call('poll_new_trades', instrument_id, client=client)
+                                         for client in self._clients))
+        return [trade for trades in batches for trade in trades]
+
+    async def fills(self, instrument_ids, interval=0.05):
+        """Async iterator over our trades on instrument_ids as they happen, polling them all concurrently."""
+        while True:
+            batches = await asyncio.gather(*(self.poll_new_trades(instrument_id) for instrument_id in instrument_ids))
+            for trades in batches:
+                for trade in trades:
+                    yield trade
+            await asyncio.sleep(interval)
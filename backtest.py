@@ -0,0 +1,140 @@
+import argparse
+import datetime as dt
+import logging
+import time
+
+import numpy as np
+
+from Code import TradingSession, INSTRUMENT_IDS, RECORDING_BOOK_LEVELS, REGISTRY
+from option_pricing import times_to_expiry, black_scholes_chain
+from simulated_exchange import BookSnapshot, SimulatedExchange
+from telemetry import Profiler
+from tick_recorder import recorded_book_stream
+
+SECONDS_PER_YEAR = 365 * 24 * 3600
+
+
+def _floor_to_tick(price, tick):
+    return round(float(np.floor(price / tick)) * tick, 4)
+
+
+def _ceil_to_tick(price, tick):
+    return round(float(np.ceil(price / tick)) * tick, 4)
+
+
+def _ladder(mid, tick, half_spread, levels, volume):
+    """Symmetric book around mid on the tick grid, dropping any level that would not be a positive price."""
+    best_bid = _floor_to_tick(mid - half_spread, tick)
+    best_ask = _ceil_to_tick(mid + half_spread, tick)
+    bids = [(round(best_bid - i * tick, 4), volume) for i in range(levels)]
+    asks = [(round(best_ask + i * tick, 4), volume) for i in range(levels)]
+    return [level for level in bids if level[0] > 0], asks
+
+
+def synthetic_book_stream(start, steps, step_seconds=1.0, seed=0, levels=5, volume=50, registry=REGISTRY):
+    """Deterministic synthetic session for ING, BAYER, SANTANDER and the option chain.
+
+    Stocks follow log random walks at the strategy's volatilities, with BAYER tied to SANTANDER through the
+    log-price relationship the pairs leg trades plus a mean-reverting spread. Options are quoted around
+    their Black-Scholes value. registry must list ING, BAYER and SANTANDER; its option chain may be any size.
+    """
+    rng = np.random.default_rng(seed)
+    step_sigma = dict(zip(registry.stock_ids, registry.stock_volatility * np.sqrt(step_seconds / SECONDS_PER_YEAR)))
+
+    log_ing = np.log(20.0)
+    log_santander = np.log(50.0)
+    spread = 0.0
+
+    underlying_index = registry.option_underlying_index
+    sigmas = registry.stock_volatility[underlying_index]
+
+    for step in range(steps):
+        timestamp = start + dt.timedelta(seconds=step * step_seconds)
+        shocks = rng.standard_normal(3)
+        log_ing += step_sigma['ING'] * shocks[0]
+        log_santander += step_sigma['SANTANDER'] * shocks[1]
+        spread = 0.98 * spread + 0.002 * shocks[2]
+        mids = {
+            'ING': np.exp(log_ing),
+            'SANTANDER': np.exp(log_santander),
+            'BAYER': np.exp(-0.57 + 1.25 * log_santander + spread),
+        }
+
+        stock_mids = np.array([mids[stock_id] for stock_id in registry.stock_ids])
+        books = {stock_id: _ladder(mid, tick, 5 * tick, levels, volume)
+                 for stock_id, mid, tick in zip(registry.stock_ids, stock_mids, registry.tick_sizes)}
+        values, _, _, _ = black_scholes_chain(
+            S=stock_mids[underlying_index], K=registry.option_strikes,
+            T=times_to_expiry(registry.unique_expiries, registry.option_expiry_index, timestamp), r=0, sigma=sigmas,
+            is_call=registry.option_is_call)
+        for option_id, value, tick in zip(registry.option_ids, values, registry.tick_sizes[registry.stock_count:]):
+            books[option_id] = _ladder(value, tick, 2 * tick, levels, volume)
+
+        yield BookSnapshot(timestamp, books)
+
+
+def run_backtest(book_stream):
+    """Replay book_stream through the strategy on a SimulatedExchange and return summary statistics."""
+    exchange = SimulatedExchange(book_stream, INSTRUMENT_IDS)
+    if not exchange.advance():
+        raise ValueError('Book stream is empty.')
+
+    profiler = Profiler()
+    started = time.perf_counter()
+    session = TradingSession(exchange, exchange, now=exchange.now, clock=exchange.monotonic, sleep=exchange.sleep,
+                             profiler=profiler)
+    while True:
+        session.market_data.poll_once()
+        session.run_iteration()
+        if not exchange.advance():
+            break
+    wall_seconds = time.perf_counter() - started
+
+    latency = profiler.summary()
+    return {
+        'iterations': latency['iteration']['count'],
+        'simulated_seconds': exchange.monotonic(),
+        'wall_seconds': wall_seconds,
+        'speedup': exchange.monotonic() / wall_seconds if wall_seconds else float('inf'),
+        'iteration_p50_ms': latency['iteration']['p50_us'] / 1e3,
+        'iteration_p99_ms': latency['iteration']['p99_us'] / 1e3,
+        'messages': exchange.message_count,
+        'pnl': exchange.get_pnl(),
+        'positions': exchange.get_positions(),
+        'latency': latency,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a trading day through the strategy offline.')
+    parser.add_argument('--hours', type=float, default=8.5, help='length of the simulated session')
+    parser.add_argument('--step', type=float, default=1.0, help='seconds between book snapshots')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--replay', metavar='DIRECTORY', help='replay books recorded by the live session instead')
+    parser.add_argument('--day', help='recorded day to replay, as YYYY-MM-DD')
+    parser.add_argument('--book-levels', type=int, default=RECORDING_BOOK_LEVELS,
+                        help='price levels per side the recording was made with')
+    parser.add_argument('--verbose', action='store_true', help='show the strategy output')
+    args = parser.parse_args()
+    logging.basicConfig(level='INFO' if args.verbose else 'WARNING', format='%(message)s')
+
+    if args.replay:
+        if not args.day:
+            parser.error('--replay requires --day')
+        stream = recorded_book_stream(args.replay, args.day, INSTRUMENT_IDS, args.book_levels)
+    else:
+        steps = int(args.hours * 3600 / args.step)
+        stream = synthetic_book_stream(dt.datetime(2022, 3, 1, 9, 0, 0), steps, step_seconds=args.step, seed=args.seed)
+    results = run_backtest(stream)
+    latency = results.pop('latency')
+
+    for key, value in results.items():
+        print(f'{key:18s}: {value}')
+    print()
+    print(f'{"stage":24s} {"count":>8s} {"p50 us":>10s} {"p99 us":>10s} {"max us":>10s}')
+    for name, summary in latency.items():
+        print(f'{name:24s} {summary["count"]:8d} {summary["p50_us"]:10.1f} {summary["p99_us"]:10.1f} {summary["max_us"]:10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+import argparse
+import datetime as dt
+import itertools
+import json
+import logging
+import threading
+import time
+import tracemalloc
+from math import ceil
+
+import numpy as np
+
+from async_exchange import AsyncExchange
+from backtest import synthetic_book_stream
+from Code import TradingSession, ORDER_CONNECTIONS, REGISTRY, quote_prices
+from cointegration_tracker import PairsTracker
+from instrument_registry import InstrumentRegistry
+from option_pricing import times_to_expiry, black_scholes_chain
+from simulated_exchange import SimulatedExchange
+from telemetry import LatencyHistogram, Profiler
+from volatility_surface import VolatilitySurface
+
+START = dt.datetime(2022, 3, 1, 9, 0, 0)
+
+# From today's chain up to where per-instrument work in the loop starts to dominate
+OPTION_COUNTS = (18, 180, 1800, 5400)
+STOCK_COUNTS = (3, 30, 100)
+
+# Options per expiry and underlying in a scaled chain, split evenly between calls and puts
+STRIKES_PER_EXPIRY = 25
+EXPIRY_SPACING = dt.timedelta(days=28)
+
+
+def scaled_registry(option_count):
+    """REGISTRY's stocks with a synthetic chain of option_count options: calls and puts on a strike ladder over
+    each underlying's strike range in REGISTRY, across as many monthly expiries as it takes."""
+    if option_count == REGISTRY.option_count:
+        return REGISTRY
+    options_by_underlying = {}
+    for i in range(REGISTRY.option_count):
+        option = REGISTRY.option(i)
+        options_by_underlying.setdefault(option.underlying_id, []).append(option)
+
+    stocks = [{'id': stock_id, 'tick_size': tick_size, 'volatility': volatility}
+              for stock_id, tick_size, volatility in zip(REGISTRY.stock_ids, REGISTRY.tick_sizes, REGISTRY.stock_volatility)]
+    options_per_underlying = ceil(option_count / len(options_by_underlying))
+    strike_count = min(ceil(options_per_underlying / 2), STRIKES_PER_EXPIRY)
+    expiry_count = ceil(options_per_underlying / (2 * strike_count))
+
+    options = []
+    for underlying_id, listed in options_by_underlying.items():
+        first_expiry = min(option.expiry for option in listed)
+        strikes = np.linspace(min(option.strike for option in listed), max(option.strike for option in listed), strike_count)
+        chain = []
+        for e in range(expiry_count):
+            expiry = first_expiry + e * EXPIRY_SPACING
+            for strike in np.round(strikes, 2):
+                for callput in ('call', 'put'):
+                    chain.append({'id': f'{underlying_id}-{expiry:%Y_%m_%d}-{strike:g}{callput[0].upper()}',
+                                  'tick_size': listed[0].tick_size, 'underlying': underlying_id, 'expiry': expiry,
+                                  'strike': float(strike), 'callput': callput})
+        options += chain[:options_per_underlying]
+    return InstrumentRegistry(stocks, options[:option_count])
+
+
+class LatencyExchange:
+    """Proxy that adds latency seconds of wall time to every call on an exchange, as a network round trip would,
+    and counts the calls. Calls from several threads wait out their latency concurrently but reach the exchange
+    one at a time, so it can stand in for a pool of connections to the same exchange."""
+
+    def __init__(self, exchange, latency):
+        self._exchange = exchange
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attribute = getattr(self._exchange, name)
+        if not callable(attribute):
+            return attribute
+
+        def delayed(*args, **kwargs):
+            if self.latency:
+                time.sleep(self.latency)
+            with self._lock:
+                self.calls += 1
+                return attribute(*args, **kwargs)
+
+        setattr(self, name, delayed)
+        return delayed
+
+
+def measure(operation, runs, setup=None, allocation_runs=None):
+    """Time runs calls of operation into a histogram, then repeat allocation_runs of them under tracemalloc.
+
+    setup, if given, runs untimed before every call. Reports throughput, latency percentiles, the peak memory
+    a call allocates on top of what is already live, and the number of blocks allocated during a call that
+    are still alive after it, from a tracemalloc snapshot diff so frees of older objects do not count.
+    """
+    if setup is not None:
+        setup()
+    operation()
+
+    histogram = LatencyHistogram()
+    busy_ns = 0
+    for _ in range(runs):
+        if setup is not None:
+            setup()
+        started = time.perf_counter_ns()
+        operation()
+        elapsed = time.perf_counter_ns() - started
+        histogram.record(elapsed)
+        busy_ns += elapsed
+
+    allocation_runs = allocation_runs or max(1, runs // 10)
+    peak_bytes = 0
+    live_blocks = 0
+    ignore_tracemalloc = (tracemalloc.Filter(False, tracemalloc.__file__),)
+    tracemalloc.start()
+    try:
+        for _ in range(allocation_runs):
+            if setup is not None:
+                setup()
+            before = tracemalloc.take_snapshot().filter_traces(ignore_tracemalloc)
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            operation()
+            peak_bytes += tracemalloc.get_traced_memory()[1] - current
+            after = tracemalloc.take_snapshot().filter_traces(ignore_tracemalloc)
+            live_blocks += sum(max(stat.count_diff, 0) for stat in after.compare_to(before, 'filename'))
+    finally:
+        tracemalloc.stop()
+
+    summary = histogram.summary()
+    return {
+        'ops_per_sec': runs / (busy_ns / 1e9) if busy_ns else float('inf'),
+        'p50_us': summary['p50_us'],
+        'p99_us': summary['p99_us'],
+        'max_us': summary['max_us'],
+        'peak_kib': peak_bytes / allocation_runs / 1024,
+        'live_blocks': live_blocks / allocation_runs,
+    }
+
+
+def _chain_inputs(registry):
+    # Each underlying at the middle of its strikes
+    underlying_index = registry.option_underlying_index
+    with np.errstate(invalid='ignore'):
+        spots = (np.bincount(underlying_index, registry.option_strikes, registry.stock_count)
+                 / np.bincount(underlying_index, minlength=registry.stock_count))
+    option_spots = spots[registry.option_underlying_index]
+    option_times = times_to_expiry(registry.unique_expiries, registry.option_expiry_index, START)
+    sigmas = registry.stock_volatility[registry.option_underlying_index]
+    return option_spots, option_times, sigmas
+
+
+def micro_benchmarks(option_counts, stock_counts, runs, seed=0):
+    """Pricing, smile fitting and quote rounding over chains of option_counts options, and the pairs z-score and
+    hedge ratio update over universes of stock_counts stocks."""
+    rng = np.random.default_rng(seed)
+    results = []
+    for option_count in option_counts:
+        registry = scaled_registry(option_count)
+        option_spots, option_times, sigmas = _chain_inputs(registry)
+        values = black_scholes_chain(option_spots, registry.option_strikes, option_times, 0, sigmas,
+                                     registry.option_is_call)[0]
+        option_mids = values * (1 + 0.02 * rng.standard_normal(len(values)))
+        tick_sizes = registry.tick_sizes[registry.stock_count:]
+        surface = VolatilitySurface(registry.option_underlying_index, registry.stock_volatility)
+
+        cases = {
+            'pricing': lambda: black_scholes_chain(option_spots, registry.option_strikes, option_times, 0, sigmas,
+                                                   registry.option_is_call),
+            'smile_fit': lambda: surface.update(option_mids, option_spots, registry.option_strikes, option_times,
+                                                registry.option_is_call),
+            'quote_rounding': lambda: quote_prices(values, tick_sizes),
+        }
+        for name, operation in cases.items():
+            results.append(dict(benchmark=name, scale=option_count, **measure(operation, runs)))
+
+    for stock_count in stock_counts:
+        stock_ids = [f'STOCK{i}' for i in range(stock_count)]
+        tracker = PairsTracker(stock_ids)
+        # A fixed walk of log prices, replayed in a loop, so every run sees the same inputs
+        walk = np.exp(np.log(50.0) + np.cumsum(1e-3 * rng.standard_normal((1000, stock_count)), axis=0))
+        prices = itertools.cycle(walk)
+        results.append(dict(benchmark='pairs_update', scale=stock_count,
+                            **measure(lambda: tracker.update(next(prices)), runs)))
+    return results
+
+
+def macro_benchmarks(option_counts, iterations, latency, connections=ORDER_CONNECTIONS, seed=0):
+    """One complete pass of the trading loop -- market data poll, fills, pricing, quoting, hedging and pairs --
+    per run, against a SimulatedExchange over a synthetic session that adds latency seconds to every call.
+
+    'iteration' sends quote refreshes one at a time through the gateway's queue, as the backtest does;
+    'iteration_batched' sends them as concurrent batches over an AsyncExchange with connections connections,
+    as the live session does.
+    """
+    results = []
+    for option_count in option_counts:
+        registry = scaled_registry(option_count)
+        for name, batched in (('iteration', False), ('iteration_batched', True)):
+            # Enough snapshots for the warm-up, the timed runs and the allocation runs, each on a fresh book
+            steps = 2 * iterations + 3
+            exchange = SimulatedExchange(synthetic_book_stream(START, steps, seed=seed, registry=registry),
+                                         registry.instrument_ids)
+            exchange.advance()
+            connection = LatencyExchange(exchange, latency)
+            async_exchange = AsyncExchange(lambda: connection, connections) if batched else None
+            session = TradingSession(connection, connection, now=exchange.now, clock=exchange.monotonic,
+                                     sleep=exchange.sleep, profiler=Profiler(), async_exchange=async_exchange,
+                                     registry=registry)
+
+            def iteration():
+                session.market_data.poll_once()
+                session.run_iteration()
+
+            calls, messages = connection.calls, exchange.message_count
+            try:
+                result = measure(iteration, iterations, setup=exchange.advance, allocation_runs=iterations)
+            finally:
+                if async_exchange is not None:
+                    async_exchange.close()
+            runs = 2 * iterations + 1
+            results.append(dict(benchmark=name, scale=option_count, **result,
+                                exchange_calls=(connection.calls - calls) / runs,
+                                order_messages=(exchange.message_count - messages) / runs))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pricing, decision logic and full trading loop.')
+    parser.add_argument('--options', type=int, nargs='+', default=OPTION_COUNTS, help='option chain sizes to run')
+    parser.add_argument('--stocks', type=int, nargs='+', default=STOCK_COUNTS, help='stock universe sizes for pairs')
+    parser.add_argument('--runs', type=int, default=1000, help='timed calls per micro-benchmark')
+    parser.add_argument('--iterations', type=int, default=50, help='timed loop iterations per macro-benchmark')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every exchange call')
+    parser.add_argument('--connections', type=int, default=ORDER_CONNECTIONS,
+                        help='order connections for the batched macro-benchmark')
+    parser.add_argument('--only', choices=('micro', 'macro'), help='run only one part')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', metavar='PATH', help='also write the results here, to compare runs')
+    args = parser.parse_args()
+    logging.basicConfig(level='WARNING', format='%(message)s')
+
+    results = []
+    if args.only != 'macro':
+        results += micro_benchmarks(args.options, args.stocks, args.runs, args.seed)
+    if args.only != 'micro':
+        results += macro_benchmarks(args.options, args.iterations, args.latency, args.connections, args.seed)
+
+    print(f'{"benchmark":16s} {"scale":>6s} {"ops/s":>10s} {"p50 us":>10s} {"p99 us":>10s} {"max us":>10s} '
+          f'{"peak KiB":>9s} {"blocks":>8s}')
+    for result in results:
+        print(f'{result["benchmark"]:16s} {result["scale"]:6d} {result["ops_per_sec"]:10.1f} {result["p50_us"]:10.1f} '
+              f'{result["p99_us"]:10.1f} {result["max_us"]:10.1f} {result["peak_kib"]:9.1f} {result["live_blocks"]:8.1f}')
+        if 'exchange_calls' in result:
+            print(f'{"":16s} {"":6s} {result["exchange_calls"]:.1f} exchange calls and '
+                  f'{result["order_messages"]:.1f} order messages per iteration')
+
+    if args.json:
+        with open(args.json, 'w') as handle:
+            json.dump({'arguments': vars(args), 'results': results}, handle, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+from cointegration_analysis import estimate_long_run_short_run_relationships, engle_granger_two_step_cointegration_test
+
+logger = logging.getLogger(__name__)
+
+
+class RingBuffer:
+    """Fixed-capacity buffer of rows of width values; the oldest row is overwritten once it is full."""
+
+    def __init__(self, capacity, width):
+        self.capacity = capacity
+        self._values = np.empty((capacity, width), dtype=float)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def append(self, row):
+        with self._lock:
+            self._values[self._count % self.capacity] = row
+            self._count += 1
+
+    def values(self):
+        """Copy of the buffered rows, oldest first."""
+        with self._lock:
+            if self._count <= self.capacity:
+                return self._values[:self._count].copy()
+            start = self._count % self.capacity
+            return np.concatenate((self._values[start:], self._values[:start]))
+
+
+class PairsTracker:
+    """Online estimate of log(y) = intercept + hedge_ratio * log(x) + spread for every pair in a stock universe.
+
+    The N*(N-1)/2 pairs (y, x) are all i < j combinations of stock_ids, with y the earlier stock. All per-pair
+    state lives in NumPy arrays, and update() runs one Kalman filter step on (intercept, hedge_ratio) with
+    random-walk dynamics -- recursive least squares with forgetting -- for every pair at once, then reports
+    each spread's z-score against the filter's own innovation variance.
+
+    Pairs with a prior from priors start from it and are assumed cointegrated; the rest start from their first
+    observation and only become tradeable once the background Engle-Granger check, run over a ring buffer of
+    recent log prices, accepts them. A pair the check newly accepts is first re-anchored on the long-run
+    relationship fitted over that same history, so it is never traded on a filter still far from its start.
+    """
+
+    def __init__(self, stock_ids, priors=None, state_noise=1e-7, observation_noise=1e-5, noise_decay=0.01,
+                 window=2000, check_interval=60.0, pvalue_threshold=0.05):
+        self.stock_ids = list(stock_ids)
+        self.y_index, self.x_index = np.triu_indices(len(self.stock_ids), k=1)
+        self.pairs = [(self.stock_ids[y], self.stock_ids[x]) for y, x in zip(self.y_index, self.x_index)]
+        self._pair_index = {pair: k for k, pair in enumerate(self.pairs)}
+        pair_count = len(self.pairs)
+
+        self.intercept = np.zeros(pair_count)
+        self.hedge_ratio = np.ones(pair_count)
+        self.spread = np.zeros(pair_count)
+        self.zscore = np.zeros(pair_count)
+        self.cointegrated = np.zeros(pair_count, dtype=bool)
+        self.pvalue = np.full(pair_count, np.nan)
+        self._initialised = np.zeros(pair_count, dtype=bool)
+        for pair, (intercept, hedge_ratio) in (priors or {}).items():
+            k = self.pair_index(*pair)
+            self.intercept[k] = intercept
+            self.hedge_ratio[k] = hedge_ratio
+            self.cointegrated[k] = True
+            self._initialised[k] = True
+
+        self.state_noise = state_noise
+        self.noise_decay = noise_decay
+        self._observation_noise = np.full(pair_count, observation_noise)
+        # Per-pair state covariance [[p00, p01], [p01, p11]]
+        self._p00 = np.full(pair_count, 1e-2)
+        self._p01 = np.zeros(pair_count)
+        self._p11 = np.full(pair_count, 1e-2)
+        # {k: (intercept, hedge_ratio)} from the background check, applied by the next update()
+        self._anchors = {}
+        self._anchors_lock = threading.Lock()
+
+        self.history = RingBuffer(window, len(self.stock_ids))
+        self.check_interval = check_interval
+        self.pvalue_threshold = pvalue_threshold
+        self._stop = threading.Event()
+        self._thread = None
+
+    def pair_index(self, y_id, x_id):
+        return self._pair_index[(y_id, x_id)]
+
+    def update(self, prices):
+        """Feed one price per stock, in stock_ids order. Pairs with a missing (NaN) leg keep their state."""
+        if self._anchors:
+            self._apply_anchors()
+        log_prices = np.log(np.asarray(prices, dtype=float))
+        if np.isfinite(log_prices).all():
+            self.history.append(log_prices)
+
+        y = log_prices[self.y_index]
+        x = log_prices[self.x_index]
+        valid = np.isfinite(y) & np.isfinite(x)
+
+        first = valid & ~self._initialised
+        self.intercept[first] = y[first] - x[first]
+        self._initialised |= first
+
+        with np.errstate(invalid='ignore'):
+            # Predict: the coefficients drift as a random walk
+            p00 = self._p00 + self.state_noise
+            p01 = self._p01
+            p11 = self._p11 + self.state_noise
+
+            # Innovation and its variance for the observation row [1, x]
+            error = y - (self.intercept + self.hedge_ratio * x)
+            p_h0 = p00 + p01 * x
+            p_h1 = p01 + p11 * x
+            innovation_variance = p_h0 + p_h1 * x + self._observation_noise
+
+            # Update
+            gain0 = p_h0 / innovation_variance
+            gain1 = p_h1 / innovation_variance
+            np.copyto(self.intercept, self.intercept + gain0 * error, where=valid)
+            np.copyto(self.hedge_ratio, self.hedge_ratio + gain1 * error, where=valid)
+            np.copyto(self._p00, p00 - gain0 * p_h0, where=valid)
+            np.copyto(self._p01, p01 - gain0 * p_h1, where=valid)
+            np.copyto(self._p11, p11 - gain1 * p_h1, where=valid)
+
+            # Track the observation noise so z-scores stay calibrated as each spread's volatility changes
+            np.copyto(self._observation_noise,
+                      self._observation_noise + self.noise_decay * (error * error - self._observation_noise), where=valid)
+
+            np.copyto(self.spread, error, where=valid)
+            np.copyto(self.zscore, error / np.sqrt(innovation_variance), where=valid)
+        return self.zscore
+
+    def _apply_anchors(self):
+        with self._anchors_lock:
+            anchors, self._anchors = self._anchors, {}
+        for k, (intercept, hedge_ratio) in anchors.items():
+            self.intercept[k] = intercept
+            self.hedge_ratio[k] = hedge_ratio
+            self._initialised[k] = True
+            self.cointegrated[k] = True
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='cointegration-check', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception('Engle-Granger check failed.')
+
+    def check(self):
+        """Run the Engle-Granger test for every pair on the buffered history and publish the results."""
+        values = self.history.values()
+        if len(values) < 100:
+            return
+        pvalues = np.empty(len(self.pairs))
+        for k, (y, x) in enumerate(zip(self.y_index, self.x_index)):
+            _, pvalues[k] = engle_granger_two_step_cointegration_test(pd.Series(values[:, y]), pd.Series(values[:, x]))
+        passing = pvalues < self.pvalue_threshold
+
+        # Newly accepted pairs stay untradeable until update() has re-anchored them on their long-run fit
+        newly_passing = passing & ~self.cointegrated
+        anchors = {int(k): self.long_run_relationship(*self.pairs[k], values=values) for k in np.flatnonzero(newly_passing)}
+        self.pvalue = pvalues
+        self.cointegrated = passing & ~newly_passing
+        if anchors:
+            with self._anchors_lock:
+                self._anchors.update(anchors)
+
+    def long_run_relationship(self, y_id, x_id, values=None):
+        """Full-history (intercept, hedge_ratio) fit for one pair over values, by default the buffered log prices."""
+        if values is None:
+            values = self.history.values()
+        y, x = self.stock_ids.index(y_id), self.stock_ids.index(x_id)
+        c, gamma, _, _ = estimate_long_run_short_run_relationships(pd.Series(values[:, y]), pd.Series(values[:, x]))
+        return c, gamma
@@ -0,0 +1,80 @@
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+
+class Execution(namedtuple('Execution', ['instrument_id', 'side', 'requested', 'filled', 'average_price', 'mid',
+                                         'orders'])):
+    """Outcome of one SmartExecutor.execute(). average_price is None if nothing filled, mid None if the book
+    it started from was one-sided."""
+    __slots__ = ()
+
+    @property
+    def slippage(self):
+        """Average price per lot paid away from the mid, positive when it cost us, or None."""
+        if self.average_price is None or self.mid is None:
+            return None
+        return self.average_price - self.mid if self.side == 'bid' else self.mid - self.average_price
+
+
+class SmartExecutor:
+    """Works immediate orders against the visible depth of the book in as few IOCs as it takes.
+
+    Each IOC is priced at the deepest level needed for the remaining volume, so one message takes every level
+    it needs at once instead of walking the price up a step at a time. The price never goes further than
+    max_distance from the touch of the book the execution started from. A further IOC is only sent if the last
+    one fell short and the feed has published a newer book since, and never more than max_orders in total.
+    """
+
+    def __init__(self, router, market_data, max_orders=2):
+        self.router = router
+        self.market_data = market_data
+        self.max_orders = max_orders
+
+    def execute(self, strategy, instrument_id, side, volume, book, max_distance):
+        """Buy ('bid') or sell ('ask') up to volume of instrument_id for strategy, starting from book."""
+        mid = book.mid
+        touch = book.best_ask if side == 'bid' else book.best_bid
+        filled = 0
+        notional = 0.0
+        orders = 0
+        while touch is not None and filled < volume and orders < self.max_orders:
+            # The limit stays within max_distance of the first touch, however the book has moved since
+            current_touch = book.best_ask if side == 'bid' else book.best_bid
+            if current_touch is None:
+                break
+            distance = max_distance - (current_touch - touch if side == 'bid' else touch - current_touch)
+            if distance < 0:
+                break
+            price, sweep_volume, expected_price = book.sweep(side, volume - filled, distance)
+            if sweep_volume <= 0:
+                break
+
+            logger.info('Inserting %s for %s: %.0f lot(s) at price %.2f, expected average %.4f.',
+                        side, instrument_id, sweep_volume, price, expected_price)
+            # Hold the router's lock until the fills are polled, so no other worker takes this IOC's trades
+            with self.router.lock:
+                reply = self.router.insert_order(strategy, instrument_id=instrument_id, price=price, volume=sweep_volume,
+                                                 side=side, order_type='ioc')
+                trades = self.router.poll_fills([instrument_id]) if reply.success else []
+            orders += 1
+            if not reply.success:
+                break
+            for trade in trades:
+                if trade.order_id == reply.order_id:
+                    filled += trade.volume
+                    notional += trade.volume * trade.price
+
+            newer_book = self.market_data.snapshot().get(instrument_id)
+            if newer_book is None or newer_book.sequence == book.sequence:
+                break
+            book = newer_book
+
+        execution = Execution(instrument_id, side, volume, filled, notional / filled if filled else None, mid, orders)
+        if filled:
+            slippage = execution.slippage
+            logger.info('Filled %.0f of %.0f lot(s) %s for %s in %d order(s) at average %.4f, slippage %.4f per lot.',
+                        filled, volume, side, instrument_id, orders, execution.average_price,
+                        float('nan') if slippage is None else slippage)
+        return execution
@@ -0,0 +1,124 @@
+import datetime as dt
+import json
+from collections import namedtuple
+
+import numpy as np
+
+from option_pricing import expiry_layout
+
+STOCK = 'stock'
+OPTION = 'option'
+
+DEFAULT_VOLATILITY = 3.0
+
+
+class Instrument(namedtuple('Instrument', ['instrument_id', 'index', 'kind', 'tick_size', 'underlying_id', 'strike',
+                                           'expiry', 'callput'])):
+    """Reference data for one instrument. underlying_id, strike, expiry and callput are None for stocks."""
+    __slots__ = ()
+
+    @property
+    def is_option(self):
+        return self.kind == OPTION
+
+
+class InstrumentRegistry:
+    """Dense integer indices and array-backed reference data for every instrument we trade.
+
+    Stocks take instrument indices [0, stock_count) and options the indices after them, so any per-instrument
+    array splits into its stock and option parts by slicing at stock_count. The option arrays (strikes, call
+    flags, underlying and expiry indices) are in option_ids order, and option_underlying_index points into
+    stock_ids.
+    """
+
+    def __init__(self, stocks, options):
+        """stocks: dicts with id, tick_size and volatility; options: dicts with id, tick_size, underlying,
+        expiry (a datetime), strike and callput ('call' or 'put')."""
+        self.instruments = []
+        for stock in stocks:
+            self.instruments.append(Instrument(stock['id'], len(self.instruments), STOCK, stock['tick_size'],
+                                               None, None, None, None))
+        self.stock_count = len(self.instruments)
+        self.stock_ids = [instrument.instrument_id for instrument in self.instruments]
+        stock_index = {stock_id: i for i, stock_id in enumerate(self.stock_ids)}
+
+        for option in options:
+            if option['underlying'] not in stock_index:
+                raise ValueError(f'''Option {option['id']} is on {option['underlying']}, which is not a registered stock.''')
+            self.instruments.append(Instrument(option['id'], len(self.instruments), OPTION, option['tick_size'],
+                                               option['underlying'], float(option['strike']), option['expiry'],
+                                               option['callput']))
+        self.option_count = len(self.instruments) - self.stock_count
+        self.option_ids = [instrument.instrument_id for instrument in self.instruments[self.stock_count:]]
+        self.instrument_ids = self.stock_ids + self.option_ids
+        self.index = {instrument_id: i for i, instrument_id in enumerate(self.instrument_ids)}
+        if len(self.index) != len(self.instruments):
+            raise ValueError('Instrument ids must be unique.')
+
+        self.tick_sizes = np.array([instrument.tick_size for instrument in self.instruments], dtype=float)
+        self.stock_volatility = np.array([stock.get('volatility', DEFAULT_VOLATILITY) for stock in stocks], dtype=float)
+
+        option_instruments = self.instruments[self.stock_count:]
+        self.option_strikes = np.array([option.strike for option in option_instruments], dtype=float)
+        self.option_is_call = np.array([option.callput == 'call' for option in option_instruments], dtype=bool)
+        self.option_underlying_index = np.array([stock_index[option.underlying_id] for option in option_instruments],
+                                                dtype=np.intp)
+        self.unique_expiries, self.option_expiry_index = expiry_layout([option.expiry for option in option_instruments])
+
+    def __len__(self):
+        return len(self.instruments)
+
+    def __getitem__(self, instrument_id):
+        return self.instruments[self.index[instrument_id]]
+
+    def option(self, option_index):
+        return self.instruments[self.stock_count + option_index]
+
+    def mask(self, instrument_ids):
+        """Boolean array over all instruments, True for each of instrument_ids that is registered."""
+        mask = np.zeros(len(self.instruments), dtype=bool)
+        mask[[self.index[instrument_id] for instrument_id in instrument_ids if instrument_id in self.index]] = True
+        return mask
+
+    def top_of_book(self, book_snapshot, is_fresh):
+        """Best bid and ask arrays over all instruments from a market data snapshot, NaN where not is_fresh(book)."""
+        best_bids = np.full(len(self.instruments), np.nan)
+        best_asks = np.full(len(self.instruments), np.nan)
+        for i, instrument_id in enumerate(self.instrument_ids):
+            book = book_snapshot[instrument_id]
+            if is_fresh(book):
+                best_bids[i] = book.best_bid
+                best_asks[i] = book.best_ask
+        return best_bids, best_asks
+
+    @classmethod
+    def from_config(cls, path):
+        """Load from a JSON file of stocks, named expiries and options; see instruments.json."""
+        with open(path) as handle:
+            config = json.load(handle)
+        default_tick_size = config.get('default_tick_size', {})
+        expiries = {name: dt.datetime.fromisoformat(expiry) for name, expiry in config.get('expiries', {}).items()}
+
+        stocks = [dict(stock, tick_size=stock.get('tick_size', default_tick_size.get(STOCK)))
+                  for stock in config['stocks']]
+        options = [dict(option, tick_size=option.get('tick_size', default_tick_size.get(OPTION)),
+                        expiry=expiries[option['expiry']])
+                   for option in config.get('options', [])]
+        return cls(stocks, options)
+
+    @classmethod
+    def from_exchange(cls, exchange, volatility=None):
+        """Build from exchange.get_instruments(), in the exchange's order. Instruments that are neither a stock nor
+        an option on a listed stock are left out. volatility maps stock ids to a starting volatility."""
+        instruments = list(exchange.get_instruments().values())
+        stocks = [{'id': instrument.instrument_id, 'tick_size': instrument.tick_size,
+                   'volatility': (volatility or {}).get(instrument.instrument_id, DEFAULT_VOLATILITY)}
+                  for instrument in instruments if getattr(instrument, 'base_instrument_id', None) is None]
+        stock_ids = {stock['id'] for stock in stocks}
+        options = [{'id': instrument.instrument_id, 'tick_size': instrument.tick_size,
+                    'underlying': instrument.base_instrument_id, 'expiry': instrument.expiry,
+                    'strike': instrument.strike,
+                    'callput': 'call' if 'call' in str(instrument.option_kind).lower() else 'put'}
+                   for instrument in instruments
+                   if getattr(instrument, 'strike', None) is not None and instrument.base_instrument_id in stock_ids]
+        return cls(stocks, options)
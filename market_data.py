@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+PriceVolume = namedtuple('PriceVolume', ['price', 'volume'])
+
+# Prices closer than this are the same price level
+PRICE_TOLERANCE = 1e-6
+
+
+class TopOfBook(namedtuple('TopOfBook', ['instrument_id', 'bids', 'asks', 'received_at', 'sequence'])):
+    """Immutable view of one instrument's book as last seen by the feed.
+
+    sequence is bumped only when the price levels change, received_at on every successful poll.
+    """
+    __slots__ = ()
+
+    @property
+    def is_empty(self):
+        return not (self.bids and self.asks)
+
+    @property
+    def best_bid(self):
+        return self.bids[0].price if self.bids else None
+
+    @property
+    def best_ask(self):
+        return self.asks[0].price if self.asks else None
+
+    @property
+    def mid(self):
+        if self.is_empty:
+            return None
+        return (self.bids[0].price + self.asks[0].price) / 2
+
+    def without_orders(self, orders):
+        """This book less our own resting orders, given as (side, price, volume); emptied levels are dropped."""
+        if not orders:
+            return self
+        return self._replace(bids=_without(self.bids, [(price, volume) for side, price, volume in orders if side == 'bid']),
+                             asks=_without(self.asks, [(price, volume) for side, price, volume in orders if side == 'ask']))
+
+    def sweep(self, side, volume, max_distance):
+        """Limit price, volume and expected volume-weighted average price for one IOC on side that takes up to
+        volume from the visible levels it would trade against, going no further than max_distance from the touch.
+        Returns (None, 0, None) if that side is empty.
+        """
+        levels = self.asks if side == 'bid' else self.bids
+        if not levels:
+            return None, 0, None
+        touch = levels[0].price
+        price = touch
+        taken = 0
+        notional = 0.0
+        for level in levels:
+            if abs(level.price - touch) > max_distance + 1e-9 or taken >= volume:
+                break
+            price = level.price
+            level_volume = min(level.volume, volume - taken)
+            taken += level_volume
+            notional += level_volume * level.price
+        return price, taken, notional / taken if taken else None
+
+
+def _without(levels, orders):
+    if not orders:
+        return levels
+    remaining = []
+    for level in levels:
+        volume = level.volume - sum(order_volume for price, order_volume in orders if abs(level.price - price) < PRICE_TOLERANCE)
+        if volume > 0:
+            remaining.append(level if volume == level.volume else level._replace(volume=volume))
+    return tuple(remaining)
+
+
+def _levels(price_volumes):
+    return tuple(PriceVolume(level.price, level.volume) for level in price_volumes or ())
+
+
+class MarketDataCache:
+    """In-memory book cache for a set of instruments, kept up to date by a background feed thread.
+
+    Readers call snapshot(), which returns a read-only mapping that the feed never mutates: every
+    publish swaps in a fresh dict, so a snapshot is consistent across instruments and costs O(1).
+    The feed should be given its own Exchange connection so it never contends with order traffic.
+    """
+
+    def __init__(self, exchange, instrument_ids, poll_interval=0.05, max_age=5.0, clock=time.monotonic):
+        self.exchange = exchange
+        self.instrument_ids = list(instrument_ids)
+        self.poll_interval = poll_interval
+        self.max_age = max_age
+        self._clock = clock
+
+        self._books = MappingProxyType({
+            instrument_id: TopOfBook(instrument_id, (), (), 0.0, 0) for instrument_id in self.instrument_ids
+        })
+        self._publish_lock = threading.Lock()
+        self._listeners = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_listener(self, callback):
+        """Call callback(book) from the feed thread for every book whose levels changed."""
+        self._listeners.append(callback)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='market-data-feed', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.poll_once()
+            self._stop.wait(self.poll_interval)
+
+    def poll_once(self):
+        """Fetch every book once and publish the results as a single new snapshot."""
+        updates = {}
+        for instrument_id in self.instrument_ids:
+            try:
+                updates[instrument_id] = self.exchange.get_last_price_book(instrument_id)
+            except Exception:
+                # A failing instrument keeps its previous book and simply ages towards stale
+                logger.exception('Failed to fetch price book for %s.', instrument_id)
+        self.publish(updates)
+
+    def publish(self, price_books):
+        """Merge {instrument_id: price_book} into the cache. Empty or missing books are recorded as empty."""
+        now = self._clock()
+        with self._publish_lock:
+            books = dict(self._books)
+            changed_books = []
+            for instrument_id, price_book in price_books.items():
+                previous = books[instrument_id]
+                bids = _levels(price_book.bids if price_book else None)
+                asks = _levels(price_book.asks if price_book else None)
+                changed = bids != previous.bids or asks != previous.asks
+                sequence = previous.sequence + 1 if changed else previous.sequence
+                books[instrument_id] = TopOfBook(instrument_id, bids, asks, now, sequence)
+                if changed:
+                    changed_books.append(books[instrument_id])
+            self._books = MappingProxyType(books)
+        for callback in self._listeners:
+            for book in changed_books:
+                callback(book)
+
+    def snapshot(self):
+        return self._books
+
+    def is_fresh(self, book, now=None):
+        """A book is usable if it has both sides and the feed has confirmed it within max_age seconds."""
+        if book.is_empty:
+            return False
+        if now is None:
+            now = self._clock()
+        return now - book.received_at <= self.max_age
+
+    @staticmethod
+    def changed_since(snapshot, seen_sequences):
+        """Instrument ids whose levels changed since the sequences in seen_sequences, which is updated in place."""
+        changed = set()
+        for instrument_id, book in snapshot.items():
+            if seen_sequences.get(instrument_id) != book.sequence:
+                seen_sequences[instrument_id] = book.sequence
+                changed.add(instrument_id)
+        return changed
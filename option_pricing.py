@@ -0,0 +1,122 @@
+import numpy as np
+from scipy.special import ndtr
+
+from libs import calculate_current_time_to_date, calculate_time_to_date
+
+SQRT_2PI = np.sqrt(2 * np.pi)
+
+
+def expiry_layout(expiry_dates):
+    """Return the unique expiries and, for every option, the index of its expiry in that list."""
+    unique_expiries = sorted(set(expiry_dates))
+    position = {expiry: i for i, expiry in enumerate(unique_expiries)}
+    expiry_index = np.array([position[expiry] for expiry in expiry_dates], dtype=np.intp)
+    return unique_expiries, expiry_index
+
+
+def times_to_expiry(unique_expiries, expiry_index, now=None):
+    """Compute time-to-expiry once per unique expiry and broadcast it over the chain.
+
+    now defaults to the wall clock; pass a datetime to price at another moment, e.g. during a replay.
+    """
+    if now is None:
+        unique_times = [calculate_current_time_to_date(expiry) for expiry in unique_expiries]
+    else:
+        unique_times = [calculate_time_to_date(expiry, now) for expiry in unique_expiries]
+    unique_times = np.array(unique_times, dtype=float)
+    return unique_times[expiry_index]
+
+
+def black_scholes_chain(S, K, T, r, sigma, is_call):
+    """Black-Scholes value, delta, gamma and vega for a whole option chain in one pass.
+
+    All inputs are broadcast against each other; is_call is a boolean mask selecting calls over puts. Options at
+    or past expiry (T <= 0) are worth their intrinsic value, with a delta of 0 or +-1 and no gamma or vega.
+    """
+    S = np.asarray(S, dtype=float)
+    K = np.asarray(K, dtype=float)
+    T = np.asarray(T, dtype=float)
+    sigma = np.asarray(sigma, dtype=float)
+    is_call = np.asarray(is_call, dtype=bool)
+
+    # Expired options are priced with a stand-in T to keep the arithmetic finite, then overwritten below
+    expired = T <= 0
+    if expired.any():
+        T = np.where(expired, 1.0, T)
+
+    sqrt_T = np.sqrt(T)
+    sigma_sqrt_T = sigma * sqrt_T
+    d1 = (np.log(S / K) + (r + 0.5 * sigma ** 2) * T) / sigma_sqrt_T
+    d2 = d1 - sigma_sqrt_T
+
+    discounted_strike = K * np.exp(-r * T)
+    # ndtr and the closed-form density skip scipy.stats' per-call argument handling, which dominates at chain sizes
+    cdf_d1 = ndtr(d1)
+    pdf_d1 = np.exp(-0.5 * d1 * d1) / SQRT_2PI
+
+    call = S * cdf_d1 - discounted_strike * ndtr(d2)
+    # Put-call parity saves a second pair of cdf evaluations for the puts
+    value = np.where(is_call, call, call - S + discounted_strike)
+    delta = np.where(is_call, cdf_d1, cdf_d1 - 1)
+    gamma = pdf_d1 / (S * sigma_sqrt_T)
+    vega = S * pdf_d1 * sqrt_T
+
+    if expired.any():
+        value = np.where(expired, np.where(is_call, np.maximum(S - K, 0.0), np.maximum(K - S, 0.0)), value)
+        delta = np.where(expired, np.where(is_call, (S > K).astype(float), -(S < K).astype(float)), delta)
+        gamma = np.where(expired, 0.0, gamma)
+        vega = np.where(expired, 0.0, vega)
+
+    return value, delta, gamma, vega
+
+
+def implied_volatility_chain(price, S, K, T, r, is_call, initial_sigma, lower=1e-4, upper=20.0,
+                             tolerance=1e-8, max_iterations=50, warm_steps=2):
+    """Implied volatility for a whole option chain at once, NaN where price admits no solution.
+
+    From a good initial_sigma (e.g. the previous tick's solution) plain Newton lands on the root within a step
+    or two, so up to warm_steps of it are tried first, at one chain pricing each. Only if some option has not
+    converged by then does each option get a bracket [lo, hi] around its root, taking a Newton step when that
+    step stays inside the bracket and bisecting otherwise, so a bad initial_sigma never diverges.
+    """
+    price = np.asarray(price, dtype=float)
+    shape = np.broadcast(price, S, K, T, is_call).shape
+    sigma = np.clip(np.broadcast_to(np.asarray(initial_sigma, dtype=float), shape), lower, upper)
+    sigma = np.where(np.isfinite(sigma), sigma, 0.5 * (lower + upper))
+    quoted = np.isfinite(price)
+
+    for _ in range(warm_steps + 1):
+        value, _, _, vega = black_scholes_chain(S, K, T, r, sigma, is_call)
+        difference = value - price
+        converged = ~quoted | (np.abs(difference) < tolerance)
+        if converged.all():
+            return np.where(quoted, sigma, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            newton = sigma - difference / vega
+        # A step out of [lower, upper] means a bad start or a price with no root; leave those to the bracket
+        if not (np.isfinite(newton) & (newton > lower) & (newton < upper))[~converged].all():
+            break
+        sigma = np.where(converged, sigma, newton)
+
+    # Prices outside what any volatility in [lower, upper] can produce have no root
+    lo = np.full(shape, lower)
+    hi = np.full(shape, upper)
+    value_lo = black_scholes_chain(S, K, T, r, lo, is_call)[0]
+    value_hi = black_scholes_chain(S, K, T, r, hi, is_call)[0]
+    solvable = quoted & (price >= value_lo) & (price <= value_hi)
+
+    converged = ~solvable
+    for _ in range(max_iterations):
+        value, _, _, vega = black_scholes_chain(S, K, T, r, sigma, is_call)
+        difference = value - price
+        converged = converged | (np.abs(difference) < tolerance)
+        if converged.all():
+            break
+        hi = np.where(difference > 0, sigma, hi)
+        lo = np.where(difference < 0, sigma, lo)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            newton = sigma - difference / vega
+        in_bracket = np.isfinite(newton) & (newton > lo) & (newton < hi)
+        sigma = np.where(converged, sigma, np.where(in_bracket, newton, 0.5 * (lo + hi)))
+
+    return np.where(solvable & converged, sigma, np.nan)
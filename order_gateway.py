@@ -0,0 +1,174 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Lower values are sent first
+HEDGE_PRIORITY = 0
+QUOTE_PRIORITY = 1
+
+# Seconds yielding traffic backs off for while a higher-priority sender is waiting for a token
+YIELD_INTERVAL = 1e-3
+
+
+class TokenBucket:
+    """Classic token bucket: refills at rate tokens per second up to capacity."""
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def wait_time(self, tokens=1):
+        """Seconds until tokens will be available."""
+        with self._lock:
+            self._refill()
+            return max(0.0, (tokens - self._tokens) / self.rate)
+
+    def acquire(self, tokens=1):
+        while not self.try_acquire(tokens):
+            self._sleep(self.wait_time(tokens))
+
+
+class YieldingBucket:
+    """A token bucket as seen by lower-priority traffic: a token is only taken while waiting() is zero, i.e.
+    while no higher-priority sender is waiting for one. Has TokenBucket's try_acquire()/acquire() interface."""
+
+    def __init__(self, bucket, waiting):
+        self.bucket = bucket
+        self.waiting = waiting
+
+    def try_acquire(self, tokens=1):
+        return not self.waiting() and self.bucket.try_acquire(tokens)
+
+    def acquire(self, tokens=1):
+        while not self.try_acquire(tokens):
+            # Leave the next tokens to whoever is ahead, then look again
+            self.bucket._sleep(max(self.bucket.wait_time(tokens + self.waiting()), YIELD_INTERVAL))
+
+
+class OrderGateway:
+    """Single outbound path for every order message, throttled by a shared token bucket.
+
+    insert_order/delete_order/amend_order mirror the Exchange methods and send immediately once a token is
+    free; hedges use these directly. Quote refreshes are instead queued with submit() under a key: a newer
+    submission for the same key replaces the pending one, and pump() drains the queue in priority order
+    for as long as the message budget allows. Quote traffic sent outside pump(), e.g. concurrent batches, takes
+    its tokens from quote_bucket, which stands aside while any direct send is waiting for a token.
+    """
+
+    def __init__(self, exchange, bucket):
+        self.exchange = exchange
+        self.bucket = bucket
+        self._queue = []
+        self._pending = {}
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._direct_waiting = 0
+        self.quote_bucket = YieldingBucket(bucket, self.direct_waiting)
+
+    def direct_waiting(self):
+        """Number of direct sends (hedges) currently waiting for a token."""
+        return self._direct_waiting
+
+    def _acquire(self):
+        if self.bucket.try_acquire():
+            return
+        with self._lock:
+            self._direct_waiting += 1
+        try:
+            self.bucket.acquire()
+        finally:
+            with self._lock:
+                self._direct_waiting -= 1
+
+    def add_listener(self, callback):
+        """Call callback(kind, instrument_id, order_id, side=..., price=..., volume=..., order_type=...) for every
+        message sent; amends carry only volume and deletes no fields."""
+        self._listeners.append(callback)
+
+    def notify(self, kind, instrument_id, order_id, **fields):
+        """Report a message sent on the gateway's behalf, e.g. in a batch, to the listeners."""
+        for callback in self._listeners:
+            callback(kind, instrument_id, order_id, **fields)
+
+    def insert_order(self, **order):
+        self._acquire()
+        reply = self.exchange.insert_order(**order)
+        if reply.success:
+            self.notify('insert', order['instrument_id'], reply.order_id,
+                         side=order['side'], price=order['price'], volume=order['volume'], order_type=order['order_type'])
+        return reply
+
+    def delete_order(self, instrument_id, order_id):
+        self._acquire()
+        deleted = self.exchange.delete_order(instrument_id, order_id=order_id)
+        if deleted:
+            self.notify('delete', instrument_id, order_id)
+        return deleted
+
+    def amend_order(self, instrument_id, order_id, volume):
+        self._acquire()
+        amended = self.exchange.amend_order(instrument_id, order_id=order_id, volume=volume)
+        if amended:
+            self.notify('amend', instrument_id, order_id, volume=volume)
+        return amended
+
+    def get_outstanding_orders(self, instrument_id):
+        return self.exchange.get_outstanding_orders(instrument_id)
+
+    def submit(self, key, priority, action):
+        """Queue action() to run on a later pump(). Replaces any still-pending action with the same key."""
+        with self._lock:
+            sequence = next(self._sequence)
+            self._pending[key] = (sequence, action)
+            heapq.heappush(self._queue, (priority, sequence, key))
+
+    def pump(self, max_actions=None):
+        """Run queued actions while tokens are available, at most max_actions of them. Returns the number run."""
+        actions_run = 0
+        while (max_actions is None or actions_run < max_actions) and self.bucket.wait_time() == 0.0:
+            with self._lock:
+                action = self._pop()
+            if action is None:
+                break
+            action()
+            actions_run += 1
+        return actions_run
+
+    def _pop(self):
+        while self._queue:
+            priority, sequence, key = heapq.heappop(self._queue)
+            pending = self._pending.get(key)
+            # Entries superseded by a newer submit() are skipped
+            if pending is not None and pending[0] == sequence:
+                del self._pending[key]
+                return pending[1]
+        return None
+
+    def pending(self):
+        return len(self._pending)
+
+    def wait_time(self):
+        return self.bucket.wait_time()
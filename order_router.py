@@ -0,0 +1,100 @@
+import threading
+
+
+class OrderRouter:
+    """The one path from the strategy workers to the trading connection.
+
+    The connection is not safe to share between threads, so every call that reaches it -- order messages,
+    fill polling and reconciliation -- is serialized on one lock. Inserts are registered with the ledger under
+    the same lock, so no worker can poll a fill before the order behind it is attributed to the strategy that
+    sent it. Ledger listeners (e.g. the quote manager's fill handler) therefore also run under the lock.
+
+    With an async_exchange, send_batch() sends many messages at once over its own pool of connections.
+    """
+
+    def __init__(self, gateway, ledger, async_exchange=None):
+        self.gateway = gateway
+        self.ledger = ledger
+        self.async_exchange = async_exchange
+        self.lock = threading.RLock()
+
+    def insert_order(self, strategy, **order):
+        with self.lock:
+            reply = self.gateway.insert_order(**order)
+            if reply.success:
+                self.ledger.register_order(reply.order_id, strategy)
+        return reply
+
+    def delete_order(self, instrument_id, order_id):
+        with self.lock:
+            return self.gateway.delete_order(instrument_id, order_id=order_id)
+
+    def amend_order(self, instrument_id, order_id, volume):
+        with self.lock:
+            return self.gateway.amend_order(instrument_id, order_id=order_id, volume=volume)
+
+    def get_outstanding_orders(self, instrument_id):
+        with self.lock:
+            return self.gateway.get_outstanding_orders(instrument_id)
+
+    def poll_fills(self, instrument_ids=None):
+        with self.lock:
+            trades = self.ledger.poll_fills(instrument_ids)
+            if self.async_exchange is not None:
+                # Batched orders are reported on the connections that sent them
+                exchange = self.async_exchange
+                batches = exchange.run(exchange.gather(*(exchange.poll_new_trades(instrument_id)
+                                                         for instrument_id in instrument_ids or self.ledger.instrument_ids)))
+                trades += self.ledger.ingest([trade for batch in batches for trade in batch])
+            return trades
+
+    def send_batch(self, messages):
+        """Send order messages concurrently through the async exchange and wait for all of their replies.
+
+        messages are (kind, fields) pairs: ('insert', {strategy, instrument_id, price, volume, side, order_type}),
+        ('delete', {instrument_id, order_id}) or ('amend', {instrument_id, order_id, volume}). Returns the replies
+        in the same order. The lock is not held while the batch is in flight; a fill that beats its insert's
+        registration is moved over to the right strategy by the ledger once the insert is registered.
+        """
+        exchange = self.async_exchange
+        actions = []
+        for kind, fields in messages:
+            if kind == 'insert':
+                actions.append(exchange.insert_order(fields['instrument_id'], price=fields['price'], volume=fields['volume'],
+                                                     side=fields['side'], order_type=fields['order_type']))
+            elif kind == 'delete':
+                actions.append(exchange.delete_order(fields['instrument_id'], order_id=fields['order_id']))
+            elif kind == 'amend':
+                actions.append(exchange.amend_order(fields['instrument_id'], order_id=fields['order_id'], volume=fields['volume']))
+            else:
+                raise ValueError(f'Unknown order message kind: {kind}.')
+        replies = exchange.run(exchange.gather(*actions))
+
+        for (kind, fields), reply in zip(messages, replies):
+            if kind == 'insert':
+                if reply.success:
+                    self.ledger.register_order(reply.order_id, fields['strategy'])
+                    self.gateway.notify('insert', fields['instrument_id'], reply.order_id,
+                                        side=fields['side'], price=fields['price'], volume=fields['volume'],
+                                        order_type=fields['order_type'])
+            elif reply:
+                extra = {'volume': fields['volume']} if kind == 'amend' else {}
+                self.gateway.notify(kind, fields['instrument_id'], fields['order_id'], **extra)
+        return replies
+
+    def maybe_reconcile(self):
+        with self.lock:
+            self.ledger.maybe_reconcile()
+
+    def reassign(self, instrument_id, from_strategy, to_strategy):
+        with self.lock:
+            self.ledger.reassign(instrument_id, from_strategy, to_strategy)
+
+    def pump(self):
+        """Run the gateway's queued actions one at a time, letting other workers' messages in between."""
+        actions_run = 0
+        while True:
+            with self.lock:
+                if not self.gateway.pump(max_actions=1):
+                    return actions_run
+            actions_run += 1
@@ -0,0 +1,79 @@
+import threading
+
+import numpy as np
+
+
+class PortfolioGreeks:
+    """Net delta and gamma per underlying of a book of options, kept current between re-prices.
+
+    reprice() takes the chain's per-option delta and gamma at the spots they were priced at and rebuilds the
+    per-underlying totals from the full option positions in one vectorized pass. Between re-prices, on_fill()
+    adjusts the totals by just the filled option's contribution, and net_delta() carries them to the current
+    spots to first order through gamma, so neither a fill nor a spot move touches the rest of the chain.
+    """
+
+    def __init__(self, underlying_ids, option_ids, option_underlying_index):
+        self.underlying_ids = list(underlying_ids)
+        self.option_ids = list(option_ids)
+        self.option_underlying_index = np.asarray(option_underlying_index, dtype=np.intp)
+        self._option_index = {option_id: i for i, option_id in enumerate(self.option_ids)}
+        underlying_count = len(self.underlying_ids)
+
+        self.option_positions = np.zeros(len(self.option_ids))
+        self.option_deltas = np.full(len(self.option_ids), np.nan)
+        self.option_gammas = np.full(len(self.option_ids), np.nan)
+        self.priced_spots = np.full(underlying_count, np.nan)
+        self.delta = np.full(underlying_count, np.nan)
+        self.gamma = np.full(underlying_count, np.nan)
+        self.priced = False
+        self._lock = threading.Lock()
+
+    def reprice(self, spots, option_deltas, option_gammas, option_positions):
+        """Adopt a new pricing of the chain. spots are per underlying; the rest per option, in option_ids order.
+
+        option_positions must be read consistently with the fills passed to on_fill(), e.g. under the lock the
+        fills are applied under, or a fill between the two would be counted twice.
+        """
+        with self._lock:
+            self.priced_spots = np.asarray(spots, dtype=float).copy()
+            self.option_deltas = np.asarray(option_deltas, dtype=float).copy()
+            self.option_gammas = np.asarray(option_gammas, dtype=float).copy()
+            self.option_positions = np.asarray(option_positions, dtype=float).copy()
+            self._aggregate()
+            self.priced = True
+
+    def _aggregate(self):
+        # An unpriced option we hold makes its underlying's totals NaN, i.e. unknown until the next re-price;
+        # one we do not hold contributes nothing either way
+        held = self.option_positions != 0
+        minlength = len(self.underlying_ids)
+        self.delta = np.bincount(self.option_underlying_index, np.where(held, self.option_positions * self.option_deltas, 0.0), minlength)
+        self.gamma = np.bincount(self.option_underlying_index, np.where(held, self.option_positions * self.option_gammas, 0.0), minlength)
+
+    def on_fill(self, trade):
+        """Ledger listener: fold an option fill into its underlying's totals. Fills on anything else are ignored."""
+        i = self._option_index.get(trade.instrument_id)
+        if i is None:
+            return
+        signed_volume = trade.volume if trade.side == 'bid' else -trade.volume
+        with self._lock:
+            u = self.option_underlying_index[i]
+            self.option_positions[i] += signed_volume
+            self.delta[u] += signed_volume * self.option_deltas[i]
+            self.gamma[u] += signed_volume * self.option_gammas[i]
+
+    def net_delta(self, spots, stock_positions):
+        """Per-underlying net delta at spots, including the hedge positions held in each underlying."""
+        with self._lock:
+            return self.delta + self.gamma * (np.asarray(spots, dtype=float) - self.priced_spots) + stock_positions
+
+    def hedge_band(self, half_spreads, risk_aversion, min_band):
+        """Whalley-Wilmott no-trade half-width per underlying: (3/2 * cost * gamma^2 / risk_aversion)^(1/3).
+
+        More gamma means delta drifts faster and each rehedge is soon undone, so the band widens; a higher
+        trading cost (half the quoted spread) widens it too. Never narrower than min_band.
+        """
+        with self._lock:
+            gamma = self.gamma.copy()
+        band = np.cbrt(1.5 * np.asarray(half_spreads, dtype=float) * gamma * gamma / risk_aversion)
+        return np.fmax(band, min_band)
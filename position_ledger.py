@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+class PositionLedger:
+    """Local position, cash and per-strategy attribution book built from our own fills.
+
+    The ledger is seeded once from the exchange and then kept current from trade events, so limit checks,
+    strategy splits and PnL are answered from memory. Orders are attributed to a strategy when they are
+    registered; fills on unregistered orders (including anything held before start-up) go to default_strategy.
+    reconcile() compares against get_positions() and corrects any drift. A fill the exchange has booked but we
+    have not polled yet looks exactly like drift, so a drift is only corrected once the next reconcile, brought
+    forward to drift_confirm_interval seconds later, finds the same drift again.
+    """
+
+    def __init__(self, exchange, instrument_ids, default_strategy, reconcile_interval=30.0, drift_confirm_interval=1.0,
+                 clock=time.monotonic):
+        self.exchange = exchange
+        self.instrument_ids = list(instrument_ids)
+        self.default_strategy = default_strategy
+        self.reconcile_interval = reconcile_interval
+        self.drift_confirm_interval = drift_confirm_interval
+        self._clock = clock
+
+        self._positions = {instrument_id: 0 for instrument_id in self.instrument_ids}
+        self._strategy_positions = defaultdict(lambda: defaultdict(int))
+        self._cash = 0.0
+        self._order_strategy = {}
+        # Fills seen before their order was registered, booked to default_strategy until it is
+        self._unregistered_fills = defaultdict(list)
+        self._lock = threading.Lock()
+        self._next_reconcile = 0.0
+        # Drift per instrument seen by the last reconcile, not yet corrected
+        self._suspected_drift = {}
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Call callback(trade) for every fill picked up by poll_fills()."""
+        self._listeners.append(callback)
+
+    def seed(self):
+        positions_and_cash = self.exchange.get_positions_and_cash()
+        with self._lock:
+            self._strategy_positions.clear()
+            self._cash = 0.0
+            for instrument_id in self.instrument_ids:
+                entry = positions_and_cash.get(instrument_id, {'volume': 0, 'cash': 0.0})
+                self._positions[instrument_id] = entry['volume']
+                self._strategy_positions[self.default_strategy][instrument_id] = entry['volume']
+                self._cash += entry['cash']
+            self._suspected_drift.clear()
+            self._next_reconcile = self._clock() + self.reconcile_interval
+
+    def register_order(self, order_id, strategy):
+        with self._lock:
+            self._order_strategy[order_id] = strategy
+            # A fill can race ahead of its order's registration when orders are sent concurrently
+            for instrument_id, signed_volume in self._unregistered_fills.pop(order_id, ()):
+                self._strategy_positions[self.default_strategy][instrument_id] -= signed_volume
+                self._strategy_positions[strategy][instrument_id] += signed_volume
+
+    def apply_fill(self, instrument_id, side, price, volume, order_id=None):
+        signed_volume = volume if side == 'bid' else -volume
+        with self._lock:
+            strategy = self._order_strategy.get(order_id)
+            if strategy is None:
+                strategy = self.default_strategy
+                if order_id is not None:
+                    self._unregistered_fills[order_id].append((instrument_id, signed_volume))
+            self._positions[instrument_id] += signed_volume
+            self._strategy_positions[strategy][instrument_id] += signed_volume
+            self._cash -= signed_volume * price
+
+    def poll_fills(self, instrument_ids=None):
+        """Pull new own trades from the exchange and apply them. Returns the trades applied."""
+        trades = []
+        for instrument_id in instrument_ids or self.instrument_ids:
+            trades.extend(self.exchange.poll_new_trades(instrument_id))
+        return self.ingest(trades)
+
+    def ingest(self, trades):
+        """Apply own trades polled elsewhere, e.g. on other order connections, and notify listeners. Returns trades."""
+        for trade in trades:
+            self.apply_fill(trade.instrument_id, trade.side, trade.price, trade.volume, trade.order_id)
+            for callback in self._listeners:
+                callback(trade)
+        return trades
+
+    def reconcile(self):
+        """Compare local totals with the exchange's and correct drift seen the same on two reconciles in a row.
+        Corrections are booked to the default strategy."""
+        positions = self.exchange.get_positions()
+        with self._lock:
+            suspected_drift = {}
+            for instrument_id in self.instrument_ids:
+                drift = positions[instrument_id] - self._positions[instrument_id]
+                if not drift:
+                    continue
+                if self._suspected_drift.get(instrument_id) != drift:
+                    # Possibly a fill still on its way to us; look again shortly
+                    suspected_drift[instrument_id] = drift
+                    logger.info('Possible ledger drift on %s: local %s, exchange %s.',
+                                instrument_id, self._positions[instrument_id], positions[instrument_id])
+                    continue
+                logger.warning('Ledger drift on %s: local %s, exchange %s. Correcting.',
+                               instrument_id, self._positions[instrument_id], positions[instrument_id])
+                self._positions[instrument_id] += drift
+                self._strategy_positions[self.default_strategy][instrument_id] += drift
+            self._suspected_drift = suspected_drift
+            self._next_reconcile = self._clock() + (self.drift_confirm_interval if suspected_drift else self.reconcile_interval)
+
+    def maybe_reconcile(self, now=None):
+        if now is None:
+            now = self._clock()
+        if now >= self._next_reconcile:
+            self.reconcile()
+
+    def position(self, instrument_id):
+        return self._positions[instrument_id]
+
+    def positions(self):
+        with self._lock:
+            return dict(self._positions)
+
+    def strategy_position(self, strategy, instrument_id):
+        return self._strategy_positions[strategy][instrument_id]
+
+    def strategy_positions(self, strategy, instrument_ids=None):
+        with self._lock:
+            book = self._strategy_positions[strategy]
+            return {instrument_id: book[instrument_id] for instrument_id in instrument_ids or self.instrument_ids}
+
+    def reassign(self, instrument_id, from_strategy, to_strategy):
+        """Move a strategy's whole position in an instrument over to another strategy."""
+        with self._lock:
+            volume = self._strategy_positions[from_strategy][instrument_id]
+            self._strategy_positions[from_strategy][instrument_id] = 0
+            self._strategy_positions[to_strategy][instrument_id] += volume
+
+    def would_breach(self, instrument_id, volume, side, position_limit=300):
+        position_instrument = self._positions[instrument_id]
+
+        if side == 'bid':
+            return position_instrument + volume > position_limit
+        elif side == 'ask':
+            return position_instrument - volume < -position_limit
+        else:
+            raise Exception(f'''Invalid side provided: {side}, expecting 'bid' or 'ask'.''')
+
+    def pnl(self, marks):
+        """Mark-to-market PnL: cash plus every position valued at marks[instrument_id]. Unmarked positions count as 0."""
+        with self._lock:
+            return self._cash + sum(
+                volume * marks[instrument_id] for instrument_id, volume in self._positions.items()
+                if volume and marks.get(instrument_id) is not None)
@@ -0,0 +1,189 @@
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+LiveQuote = namedtuple('LiveQuote', ['order_id', 'price', 'volume'])
+
+PRICE_TOLERANCE = 1e-6
+
+
+class QuoteManager:
+    """Keeps one resting limit order per instrument and side, and only sends the messages needed to move it.
+
+    update() diffs the desired bid/ask against what we believe is live: unchanged quotes send nothing,
+    a changed volume at the same price is amended in place (keeping queue priority), and a changed price
+    is a cancel plus insert. Fills must be reported through on_fill() so the remembered volumes stay true.
+    Orders go out through the order router, which attributes them to strategy. update_all() does the same diff
+    for many instruments at once and sends every resulting message as one concurrent batch.
+    """
+
+    def __init__(self, router, strategy):
+        self.router = router
+        self.strategy = strategy
+        self._live = {}
+        self._by_order_id = {}
+        self._batches_in_flight = 0
+        self._early_fills = {}
+
+    def live_quote(self, instrument_id, side):
+        return self._live.get((instrument_id, side))
+
+    def cancel_all(self, instrument_ids):
+        """Remove every outstanding order on instrument_ids, including ones left over from a previous run."""
+        for instrument_id in instrument_ids:
+            for order in self.router.get_outstanding_orders(instrument_id).values():
+                self.router.delete_order(instrument_id, order_id=order.order_id)
+            for side in ('bid', 'ask'):
+                self._forget(instrument_id, side)
+
+    def update(self, instrument_id, desired_bid, desired_ask, volume):
+        """Bring both sides in line with the desired prices. A price of None pulls that side. Returns messages sent."""
+        return (self._update_side(instrument_id, 'bid', desired_bid, volume)
+                + self._update_side(instrument_id, 'ask', desired_ask, volume))
+
+    def on_fill(self, order_id, volume):
+        key = self._by_order_id.get(order_id)
+        if key is None:
+            # A batched insert can trade before its reply has been processed; hold the fill until it is
+            if self._batches_in_flight:
+                self._early_fills[order_id] = self._early_fills.get(order_id, 0) + volume
+            return
+        live = self._live[key]
+        remaining = live.volume - volume
+        if remaining > 0:
+            self._live[key] = live._replace(volume=remaining)
+        else:
+            self._forget(*key)
+
+    def update_all(self, quotes):
+        """Batch update() for [(instrument_id, desired_bid, desired_ask, volume)]. Returns messages sent.
+
+        Every cancel, amend and insert goes out at once and is awaited together; cancels and inserts replacing
+        rejected amends follow in a second batch. Bookkeeping happens under the router lock, as fills do.
+        """
+        with self.router.lock:
+            planned = [message for instrument_id, desired_bid, desired_ask, volume in quotes
+                       for side, price in (('bid', desired_bid), ('ask', desired_ask))
+                       for message in self._plan(instrument_id, side, price, volume)]
+            self._batches_in_flight += 1
+        messages = 0
+        try:
+            while planned:
+                replies = self.router.send_batch([message for message, _ in planned])
+                messages += len(planned)
+                with self.router.lock:
+                    planned = self._apply(planned, replies)
+        finally:
+            with self.router.lock:
+                self._batches_in_flight -= 1
+                if not self._batches_in_flight:
+                    self._early_fills.clear()
+        return messages
+
+    def _plan(self, instrument_id, side, price, volume):
+        # The same diff as _update_side(), as (message, live quote it acts on) pairs for the router
+        live = self._live.get((instrument_id, side))
+        if price is None:
+            return [self._delete_message(instrument_id, live)] if live is not None else []
+        if live is not None and abs(live.price - price) < PRICE_TOLERANCE:
+            if live.volume == volume:
+                return []
+            return [(('amend', {'instrument_id': instrument_id, 'side': side, 'order_id': live.order_id, 'volume': volume}), live)]
+        planned = [self._delete_message(instrument_id, live)] if live is not None else []
+        planned.append(self._insert_message(instrument_id, side, price, volume))
+        return planned
+
+    @staticmethod
+    def _delete_message(instrument_id, live):
+        return ('delete', {'instrument_id': instrument_id, 'order_id': live.order_id}), live
+
+    def _insert_message(self, instrument_id, side, price, volume):
+        return ('insert', {'strategy': self.strategy, 'instrument_id': instrument_id, 'price': price, 'volume': volume,
+                           'side': side, 'order_type': 'limit'}), None
+
+    def _apply(self, planned, replies):
+        """Book a batch's replies. Returns the follow-up cancels and inserts for amends that were rejected."""
+        retries = []
+        for ((kind, fields), live), reply in zip(planned, replies):
+            instrument_id = fields['instrument_id']
+            if kind == 'delete':
+                self._forget_order(live.order_id)
+                logger.info('Deleted %s on %s.', live.order_id, instrument_id)
+            elif kind == 'amend':
+                key = self._by_order_id.get(live.order_id)
+                if reply and key is not None:
+                    self._live[key] = self._live[key]._replace(volume=fields['volume'])
+                    logger.info('Amended %s on %s to %s lot(s).', live.order_id, instrument_id, fields['volume'])
+                elif not reply:
+                    # Amend rejected (e.g. the order just traded out, or the exchange refused to grow it), so cancel
+                    # it in case it is still resting, as _update_side() does, and replace it with a fresh order
+                    self._forget_order(live.order_id)
+                    retries.append(self._delete_message(instrument_id, live))
+                    retries.append(self._insert_message(instrument_id, fields['side'], live.price, fields['volume']))
+            elif not reply.success:
+                logger.warning('Failed to insert %s on %s at %.2f.', fields['side'], instrument_id, fields['price'])
+            else:
+                remaining = fields['volume'] - self._early_fills.pop(reply.order_id, 0)
+                if remaining > 0:
+                    key = (instrument_id, fields['side'])
+                    self._live[key] = LiveQuote(reply.order_id, fields['price'], remaining)
+                    self._by_order_id[reply.order_id] = key
+                logger.info('Inserted %s %s on %s: %s lot(s) at %.2f.', fields['side'], reply.order_id, instrument_id,
+                            fields['volume'], fields['price'])
+        return retries
+
+    def _update_side(self, instrument_id, side, price, volume):
+        live = self._live.get((instrument_id, side))
+
+        if price is None:
+            if live is None:
+                return 0
+            self._cancel(instrument_id, side, live)
+            return 1
+
+        if live is not None and abs(live.price - price) < PRICE_TOLERANCE:
+            if live.volume == volume:
+                return 0
+            if self.router.amend_order(instrument_id, order_id=live.order_id, volume=volume):
+                logger.info('Amended %s %s on %s to %s lot(s).', side, live.order_id, instrument_id, volume)
+                self._live[(instrument_id, side)] = live._replace(volume=volume)
+                return 1
+            # Amend rejected (e.g. the order just traded out), fall through to a fresh order
+
+        messages = 0
+        if live is not None:
+            self._cancel(instrument_id, side, live)
+            messages += 1
+        self._insert(instrument_id, side, price, volume)
+        return messages + 1
+
+    def _insert(self, instrument_id, side, price, volume):
+        reply = self.router.insert_order(
+            self.strategy,
+            instrument_id=instrument_id,
+            price=price,
+            volume=volume,
+            side=side,
+            order_type='limit')
+        if not reply.success:
+            logger.warning('Failed to insert %s on %s at %.2f.', side, instrument_id, price)
+            return
+        self._live[(instrument_id, side)] = LiveQuote(reply.order_id, price, volume)
+        self._by_order_id[reply.order_id] = (instrument_id, side)
+        logger.info('Inserted %s %s on %s: %s lot(s) at %.2f.', side, reply.order_id, instrument_id, volume, price)
+
+    def _cancel(self, instrument_id, side, live):
+        self.router.delete_order(instrument_id, order_id=live.order_id)
+        self._forget(instrument_id, side)
+        logger.info('Deleted %s %s on %s.', side, live.order_id, instrument_id)
+
+    def _forget_order(self, order_id):
+        key = self._by_order_id.pop(order_id, None)
+        if key is not None:
+            self._live.pop(key, None)
+
+    def _forget(self, instrument_id, side):
+        live = self._live.pop((instrument_id, side), None)
+        if live is not None:
+            self._by_order_id.pop(live.order_id, None)
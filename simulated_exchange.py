@@ -0,0 +1,257 @@
+import datetime as dt
+import itertools
+import math
+from collections import deque, namedtuple
+
+from market_data import PriceVolume
+
+PriceBook = namedtuple('PriceBook', ['instrument_id', 'timestamp', 'bids', 'asks'])
+InsertOrderReply = namedtuple('InsertOrderReply', ['order_id', 'success'])
+OrderStatus = namedtuple('OrderStatus', ['order_id', 'instrument_id', 'price', 'volume', 'side'])
+Trade = namedtuple('Trade', ['order_id', 'instrument_id', 'price', 'volume', 'side'])
+
+# One snapshot of replayed market liquidity: {instrument_id: (bids, asks)}, each a list of (price, volume)
+BookSnapshot = namedtuple('BookSnapshot', ['timestamp', 'books'])
+
+OWN = 'own'
+MARKET = 'market'
+
+
+class _Order:
+    __slots__ = ('order_id', 'owner', 'side', 'price', 'volume')
+
+    def __init__(self, order_id, owner, side, price, volume):
+        self.order_id = order_id
+        self.owner = owner
+        self.side = side
+        self.price = price
+        self.volume = volume
+
+
+class OrderBook:
+    """Price-time priority limit order book for a single instrument.
+
+    Each price level is a FIFO queue of resting orders; an incoming order trades against the best opposite
+    levels in arrival order, always at the resting order's price.
+    """
+
+    def __init__(self, instrument_id):
+        self.instrument_id = instrument_id
+        self._levels = {'bid': {}, 'ask': {}}
+
+    def _best_price(self, side):
+        levels = self._levels[side]
+        if not levels:
+            return None
+        return max(levels) if side == 'bid' else min(levels)
+
+    def _crosses(self, side, price, resting_price):
+        return price >= resting_price if side == 'bid' else price <= resting_price
+
+    def match(self, order):
+        """Trade order against the opposite side. Returns [(resting_order, price, volume)] for each fill."""
+        opposite = 'ask' if order.side == 'bid' else 'bid'
+        levels = self._levels[opposite]
+        fills = []
+        while order.volume > 0:
+            best = self._best_price(opposite)
+            if best is None or not self._crosses(order.side, order.price, best):
+                break
+            queue = levels[best]
+            resting = queue[0]
+            volume = min(order.volume, resting.volume)
+            order.volume -= volume
+            resting.volume -= volume
+            fills.append((resting, best, volume))
+            if resting.volume == 0:
+                queue.popleft()
+                if not queue:
+                    del levels[best]
+        return fills
+
+    def rest(self, order):
+        self._levels[order.side].setdefault(order.price, deque()).append(order)
+
+    def remove(self, order):
+        levels = self._levels[order.side]
+        queue = levels.get(order.price)
+        if queue is None or order not in queue:
+            return False
+        queue.remove(order)
+        if not queue:
+            del levels[order.price]
+        return True
+
+    def remove_owner(self, owner):
+        for levels in self._levels.values():
+            for price in list(levels):
+                queue = deque(order for order in levels[price] if order.owner != owner)
+                if queue:
+                    levels[price] = queue
+                else:
+                    del levels[price]
+
+    def depth(self, side):
+        levels = self._levels[side]
+        prices = sorted(levels, reverse=(side == 'bid'))
+        return [PriceVolume(price, sum(order.volume for order in levels[price])) for price in prices]
+
+
+class SimulatedExchange:
+    """Offline stand-in for optibook.synchronous_client.Exchange, driven by a stream of BookSnapshots.
+
+    Market liquidity from the stream is loaded into a price-time matching engine next to our own orders.
+    advance() replaces the market's orders with the next snapshot; any snapshot level that crosses one of
+    our resting orders trades against it at our price. Our own limit and IOC orders trade against whatever
+    is resting, consuming visible liquidity until the next snapshot refreshes it.
+
+    Time is simulated: now()/monotonic() follow the replayed timestamps and sleep() only moves the clock,
+    so a day replays as fast as the strategy can process it.
+    """
+
+    def __init__(self, book_stream, instrument_ids=None):
+        self._stream = iter(book_stream)
+        self._books = {}
+        self._orders = {}
+        self._positions = {}
+        self._cash = {}
+        self._new_trades = {}
+        self._order_ids = itertools.count(1)
+        self._market_order_ids = itertools.count(-1, -1)
+        self._start = None
+        self._elapsed = 0.0
+        self.message_count = 0
+        for instrument_id in instrument_ids or ():
+            self._book(instrument_id)
+
+    def _book(self, instrument_id):
+        book = self._books.get(instrument_id)
+        if book is None:
+            book = self._books[instrument_id] = OrderBook(instrument_id)
+            self._positions[instrument_id] = 0
+            self._cash[instrument_id] = 0.0
+            self._new_trades[instrument_id] = []
+        return book
+
+    def connect(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    # Simulated clock
+
+    def now(self):
+        return self._start + dt.timedelta(seconds=self._elapsed)
+
+    def monotonic(self):
+        return self._elapsed
+
+    def sleep(self, seconds):
+        # Time is kept as float seconds, and even a wait too short to register still moves the clock, so a
+        # caller polling until some deadline always gets there
+        self._elapsed = max(self._elapsed + max(0.0, seconds), math.nextafter(self._elapsed, math.inf))
+
+    def advance(self):
+        """Load the next snapshot from the stream. Returns False once the stream is exhausted."""
+        snapshot = next(self._stream, None)
+        if snapshot is None:
+            return False
+        if self._start is None:
+            self._start = snapshot.timestamp
+        # The clock never runs backwards, even if the strategy slept past the next snapshot
+        self._elapsed = max(self._elapsed, (snapshot.timestamp - self._start).total_seconds())
+        for instrument_id, (bids, asks) in snapshot.books.items():
+            book = self._book(instrument_id)
+            book.remove_owner(MARKET)
+            for side, levels in (('bid', bids), ('ask', asks)):
+                for price, volume in levels:
+                    self._execute(book, _Order(next(self._market_order_ids), MARKET, side, price, volume))
+        return True
+
+    # Exchange interface
+
+    def get_last_price_book(self, instrument_id):
+        book = self._book(instrument_id)
+        return PriceBook(instrument_id, self.now(), book.depth('bid'), book.depth('ask'))
+
+    def get_positions(self):
+        return dict(self._positions)
+
+    def get_positions_and_cash(self):
+        return {instrument_id: {'volume': self._positions[instrument_id], 'cash': self._cash[instrument_id]}
+                for instrument_id in self._positions}
+
+    def get_pnl(self):
+        pnl = sum(self._cash.values())
+        for instrument_id, position in self._positions.items():
+            if not position:
+                continue
+            book = self._books[instrument_id]
+            bids, asks = book.depth('bid'), book.depth('ask')
+            if bids and asks:
+                pnl += position * (bids[0].price + asks[0].price) / 2
+        return pnl
+
+    def insert_order(self, instrument_id, *, price, volume, side, order_type):
+        self.message_count += 1
+        if side not in ('bid', 'ask') or order_type not in ('limit', 'ioc') or volume <= 0:
+            return InsertOrderReply(None, False)
+        order = _Order(next(self._order_ids), OWN, side, price, volume)
+        book = self._book(instrument_id)
+        self._execute(book, order, rest=(order_type == 'limit'))
+        return InsertOrderReply(order.order_id, True)
+
+    def get_outstanding_orders(self, instrument_id):
+        return {order.order_id: OrderStatus(order.order_id, instrument_id, order.price, order.volume, order.side)
+                for order, order_instrument_id in self._orders.values() if order_instrument_id == instrument_id}
+
+    def delete_order(self, instrument_id, *, order_id):
+        self.message_count += 1
+        entry = self._orders.pop(order_id, None)
+        if entry is None:
+            return False
+        return self._books[instrument_id].remove(entry[0])
+
+    def amend_order(self, instrument_id, *, order_id, volume):
+        self.message_count += 1
+        entry = self._orders.get(order_id)
+        if entry is None or volume <= 0:
+            return False
+        order = entry[0]
+        if volume > order.volume:
+            # Growing an order sends it to the back of its price level, as on a real exchange
+            book = self._books[instrument_id]
+            book.remove(order)
+            order.volume = volume
+            book.rest(order)
+        else:
+            order.volume = volume
+        return True
+
+    def poll_new_trades(self, instrument_id):
+        self._book(instrument_id)
+        trades = self._new_trades[instrument_id]
+        self._new_trades[instrument_id] = []
+        return trades
+
+    # Matching
+
+    def _execute(self, book, order, rest=True):
+        for resting, price, volume in book.match(order):
+            self._record_fill(book.instrument_id, resting, price, volume)
+            self._record_fill(book.instrument_id, order, price, volume)
+        if order.volume > 0 and rest:
+            book.rest(order)
+            if order.owner == OWN:
+                self._orders[order.order_id] = (order, book.instrument_id)
+
+    def _record_fill(self, instrument_id, order, price, volume):
+        if order.owner != OWN:
+            return
+        signed_volume = volume if order.side == 'bid' else -volume
+        self._positions[instrument_id] += signed_volume
+        self._cash[instrument_id] -= signed_volume * price
+        self._new_trades[instrument_id].append(Trade(order.order_id, instrument_id, price, volume, order.side))
+        if order.volume == 0:
+            self._orders.pop(order.order_id, None)
@@ -0,0 +1,56 @@
+import logging
+import threading
+
+from telemetry import Profiler
+
+logger = logging.getLogger(__name__)
+
+
+class StrategyWorker:
+    """Runs one strategy's step() on its own thread, so a slow strategy never holds up the others.
+
+    The step runs whenever wake() is called (it doubles as a market data or ledger listener) and at least
+    every interval seconds. A step may return the number of seconds after which it wants to run again
+    regardless, e.g. when it still has messages queued behind the rate limit.
+    """
+
+    def __init__(self, name, step, interval=1.0, profiler=None):
+        self.name = name
+        self.step = step
+        self.interval = interval
+        self.profiler = profiler if profiler is not None else Profiler(enabled=False)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def wake(self, *_):
+        self._wake.set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f'strategy-{self.name}', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        timeout = self.interval
+        while not self._stop.is_set():
+            self._wake.wait(timeout)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                with self.profiler.stage(f'worker.{self.name}'):
+                    rerun_after = self.step()
+            except Exception:
+                logger.exception('%s step failed.', self.name)
+                rerun_after = None
+            timeout = self.interval if rerun_after is None else min(self.interval, rerun_after)
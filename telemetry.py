@@ -0,0 +1,189 @@
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+# Values below 2**(SUB_BUCKET_BITS + 1) ns are recorded exactly; above that every power-of-two range is split
+# into 2**SUB_BUCKET_BITS buckets, i.e. about 3% relative precision from nanoseconds up to hours.
+SUB_BUCKET_BITS = 5
+_SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+_EXACT_LIMIT = _SUB_BUCKETS << 1
+_MAX_SHIFT = 48
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram:
+    """HDR-style log-linear histogram of nanosecond durations with O(1) record()."""
+
+    def __init__(self):
+        self.counts = np.zeros(_EXACT_LIMIT + _MAX_SHIFT * _SUB_BUCKETS, dtype=np.int64)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    @staticmethod
+    def _index(value):
+        if value < _EXACT_LIMIT:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS - 1
+        return _EXACT_LIMIT + (shift - 1) * _SUB_BUCKETS + (value >> shift) - _SUB_BUCKETS
+
+    @staticmethod
+    def _lower_bound(index):
+        if index < _EXACT_LIMIT:
+            return index
+        shift, mantissa = divmod(index - _EXACT_LIMIT, _SUB_BUCKETS)
+        return (mantissa + _SUB_BUCKETS) << (shift + 1)
+
+    def record(self, nanoseconds):
+        nanoseconds = max(0, int(nanoseconds))
+        self.counts[min(self._index(nanoseconds), len(self.counts) - 1)] += 1
+        self.count += 1
+        self.total += nanoseconds
+        if nanoseconds > self.max:
+            self.max = nanoseconds
+
+    def percentile(self, percentile):
+        if not self.count:
+            return 0
+        rank = int(np.ceil(self.count * percentile / 100.0))
+        index = int(np.searchsorted(np.cumsum(self.counts), max(rank, 1)))
+        return min(self._lower_bound(index), self.max)
+
+    def summary(self):
+        """count, mean, max and PERCENTILES, all in microseconds."""
+        summary = {'count': self.count, 'mean_us': self.total / self.count / 1e3 if self.count else 0.0,
+                   'max_us': self.max / 1e3}
+        for percentile in PERCENTILES:
+            summary[f'p{percentile:g}_us'] = self.percentile(percentile) / 1e3
+        return summary
+
+
+class Profiler:
+    """Named latency histograms: stage() times a block, record() takes a duration measured elsewhere.
+
+    A disabled profiler makes stage() a near no-op, so instrumentation can stay in the hot path.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, LatencyHistogram())
+        return histogram
+
+    def record(self, name, nanoseconds):
+        if self.enabled:
+            self.histogram(name).record(nanoseconds)
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.histogram(name).record(time.perf_counter_ns() - started)
+
+    def summary(self):
+        with self._lock:
+            names = sorted(self.histograms)
+        return {name: self.histograms[name].summary() for name in names}
+
+
+class InstrumentedExchange:
+    """Transparent proxy that times every method call on an exchange into 'exchange.<method>' histograms."""
+
+    def __init__(self, exchange, profiler):
+        self._exchange = exchange
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        attribute = getattr(self._exchange, name)
+        if not callable(attribute):
+            return attribute
+        histogram_name = f'exchange.{name}'
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter_ns()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                self._profiler.record(histogram_name, time.perf_counter_ns() - started)
+
+        # Cache the wrapper so later lookups skip __getattr__
+        setattr(self, name, timed)
+        return timed
+
+
+class MetricsExporter:
+    """Background thread appending the profiler's summary as one JSON line to path every interval seconds."""
+
+    def __init__(self, profiler, path, interval=10.0):
+        self.profiler = profiler
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='metrics-exporter', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.export()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.export()
+            except Exception:
+                logging.getLogger(__name__).exception('Failed to export metrics.')
+
+    def export(self):
+        with open(self.path, 'a') as handle:
+            handle.write(json.dumps({'timestamp': time.time(), 'latency': self.profiler.summary()}) + '\n')
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    # The stock QueueHandler formats the message on the calling thread; leave that to the listener instead
+    def prepare(self, record):
+        return record
+
+
+def start_async_logging(level, handler=None):
+    """Route all logging through a queue so callers only pay for enqueueing; a listener thread formats and writes.
+
+    Returns the started QueueListener; stop() it to flush on shutdown.
+    """
+    log_queue = queue.SimpleQueue()
+    if handler is None:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_DeferredQueueHandler(log_queue))
+    listener.start()
+    return listener
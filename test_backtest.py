@@ -0,0 +1,31 @@
+import datetime as dt
+
+from backtest import run_backtest, synthetic_book_stream
+from simulated_exchange import BookSnapshot, SimulatedExchange
+
+START = dt.datetime(2022, 3, 1, 9, 0, 0)
+
+
+def test_sleeps_too_short_to_register_still_move_the_clock():
+    exchange = SimulatedExchange([BookSnapshot(START, {})])
+    exchange.advance()
+    exchange.sleep(0.3)
+    for _ in range(1000):
+        exchange.sleep(1e-17)
+    assert exchange.monotonic() > 0.3
+
+
+def test_clock_follows_snapshots_and_never_runs_backwards():
+    exchange = SimulatedExchange([BookSnapshot(START, {}), BookSnapshot(START + dt.timedelta(seconds=1), {})])
+    exchange.advance()
+    exchange.sleep(2.5)
+    exchange.advance()
+    assert exchange.monotonic() == 2.5
+    assert exchange.now() == START + dt.timedelta(seconds=2.5)
+
+
+def test_replays_thousands_of_snapshots():
+    steps = 3000
+    results = run_backtest(synthetic_book_stream(START, steps))
+    assert results['iterations'] == steps
+    assert results['simulated_seconds'] >= steps - 1
@@ -0,0 +1,81 @@
+import datetime as dt
+
+import pytest
+
+from execution import SmartExecutor
+from market_data import MarketDataCache
+from order_gateway import OrderGateway, TokenBucket
+from order_router import OrderRouter
+from position_ledger import PositionLedger
+from simulated_exchange import BookSnapshot, SimulatedExchange
+
+START = dt.datetime(2022, 3, 1, 9, 0, 0)
+BIDS = [(9.0, 50)]
+
+
+class CaughtUpFeed:
+    """The cache as the background feed would have left it by the time anyone looks: polled on every snapshot()."""
+
+    def __init__(self, market_data):
+        self.market_data = market_data
+
+    def snapshot(self):
+        self.market_data.poll_once()
+        return self.market_data.snapshot()
+
+
+def stale_book_executor(seen_asks, actual_asks, max_orders=2):
+    """An executor whose starting book shows seen_asks while the exchange already holds actual_asks."""
+    exchange = SimulatedExchange([BookSnapshot(START, {'X': (BIDS, seen_asks)}),
+                                  BookSnapshot(START + dt.timedelta(seconds=1), {'X': (BIDS, actual_asks)})], ['X'])
+    exchange.advance()
+    market_data = MarketDataCache(exchange, ['X'], clock=exchange.monotonic)
+    market_data.poll_once()
+    book = market_data.snapshot()['X']
+    exchange.advance()
+
+    gateway = OrderGateway(exchange, TokenBucket(rate=1000, capacity=1000, clock=exchange.monotonic, sleep=exchange.sleep))
+    ledger = PositionLedger(exchange, ['X'], default_strategy='hedger', clock=exchange.monotonic)
+    ledger.seed()
+    router = OrderRouter(gateway, ledger)
+    return exchange, ledger, SmartExecutor(router, CaughtUpFeed(market_data), max_orders=max_orders), book
+
+
+def test_one_ioc_sweeps_every_level_it_needs():
+    asks = [(10.0, 5), (10.1, 5), (10.2, 20)]
+    exchange, ledger, executor, book = stale_book_executor(asks, asks)
+    execution = executor.execute('hedger', 'X', 'bid', 12, book, max_distance=0.3)
+
+    assert (execution.filled, execution.orders) == (12, 1)
+    assert execution.average_price == pytest.approx((5 * 10.0 + 5 * 10.1 + 2 * 10.2) / 12)
+    assert execution.slippage == pytest.approx(execution.average_price - 9.5)
+    assert ledger.position('X') == 12
+
+
+def test_sweep_stops_at_max_distance():
+    exchange, ledger, executor, book = stale_book_executor([(10.0, 5), (10.1, 5), (10.5, 20)],
+                                                           [(10.0, 5), (10.1, 5), (10.5, 20)])
+    execution = executor.execute('hedger', 'X', 'bid', 12, book, max_distance=0.2)
+    assert (execution.filled, execution.orders) == (10, 1)
+    assert exchange.get_positions()['X'] == 10
+
+
+def test_second_ioc_follows_a_newer_book_within_max_distance():
+    exchange, ledger, executor, book = stale_book_executor([(10.0, 10)], [(10.0, 4), (10.1, 10)])
+    execution = executor.execute('hedger', 'X', 'bid', 10, book, max_distance=0.2)
+
+    assert (execution.filled, execution.orders) == (10, 2)
+    assert execution.average_price == pytest.approx((4 * 10.0 + 6 * 10.1) / 10)
+    assert ledger.position('X') == 10
+
+
+def test_no_second_ioc_beyond_max_distance_of_the_first_touch():
+    exchange, ledger, executor, book = stale_book_executor([(10.0, 10)], [(10.0, 4), (10.5, 10)])
+    execution = executor.execute('hedger', 'X', 'bid', 10, book, max_distance=0.2)
+    assert (execution.filled, execution.orders) == (4, 1)
+
+
+def test_no_more_than_max_orders():
+    exchange, ledger, executor, book = stale_book_executor([(10.0, 10)], [(10.0, 4), (10.1, 10)], max_orders=1)
+    execution = executor.execute('hedger', 'X', 'bid', 10, book, max_distance=0.2)
+    assert (execution.filled, execution.orders) == (4, 1)
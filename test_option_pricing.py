@@ -0,0 +1,40 @@
+import numpy as np
+
+from option_pricing import black_scholes_chain
+
+S = np.array([90.0, 100.0, 110.0, 90.0, 100.0, 110.0])
+K = np.full(6, 100.0)
+IS_CALL = np.array([True, True, True, False, False, False])
+
+
+def test_known_value_and_put_call_parity():
+    value, delta, gamma, vega = black_scholes_chain(100.0, 100.0, 1.0, 0.0, 0.2, [True, False])
+    np.testing.assert_allclose(value, [7.965567, 7.965567], atol=1e-6)
+    np.testing.assert_allclose(delta, [0.539828, 0.539828 - 1], atol=1e-6)
+    np.testing.assert_allclose(gamma, 0.019848, atol=1e-6)
+    np.testing.assert_allclose(vega, 39.695255, atol=1e-6)
+
+
+def test_expired_options_are_worth_intrinsic():
+    for T in (0.0, -0.5):
+        with np.errstate(all='raise'):
+            value, delta, gamma, vega = black_scholes_chain(S, K, np.full(6, T), 0.0, 0.2, IS_CALL)
+        np.testing.assert_array_equal(value, [0, 0, 10, 10, 0, 0])
+        np.testing.assert_array_equal(delta, [0, 0, 1, -1, 0, 0])
+        np.testing.assert_array_equal(gamma, 0)
+        np.testing.assert_array_equal(vega, 0)
+
+
+def test_expired_and_live_options_price_together():
+    T = np.array([0.0, 0.5, 0.0, 0.5, 0.0, 0.5])
+    value, delta, _, _ = black_scholes_chain(S, K, T, 0.0, 0.2, IS_CALL)
+    live = T > 0
+    live_value, live_delta, _, _ = black_scholes_chain(S[live], K[live], T[live], 0.0, 0.2, IS_CALL[live])
+    np.testing.assert_array_equal(value[live], live_value)
+    np.testing.assert_array_equal(delta[live], live_delta)
+    np.testing.assert_array_equal(value[~live], [0, 10, 0])
+
+
+def test_value_converges_to_intrinsic_at_expiry():
+    value, _, _, _ = black_scholes_chain(S, K, np.full(6, 1e-12), 0.0, 0.2, IS_CALL)
+    np.testing.assert_allclose(value, [0, 0, 10, 10, 0, 0], atol=1e-4)
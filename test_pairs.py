@@ -0,0 +1,68 @@
+import datetime as dt
+
+import numpy as np
+
+from Code import TradingSession, pair_strategy
+from simulated_exchange import BookSnapshot, SimulatedExchange
+
+START = dt.datetime(2022, 3, 1, 9, 0, 0)
+
+STOCK_BOOKS = {
+    'ING': ([(19.9, 200)], [(20.1, 200)]),
+    'BAYER': ([(59.9, 200)], [(60.1, 200)]),
+    'SANTANDER': ([(39.9, 200)], [(40.1, 200)]),
+}
+
+
+def pairs_session():
+    exchange = SimulatedExchange([BookSnapshot(START, STOCK_BOOKS)])
+    exchange.advance()
+    session = TradingSession(exchange, exchange, now=exchange.now, clock=exchange.monotonic, sleep=exchange.sleep)
+    session.market_data.poll_once()
+    return exchange, session
+
+
+def signal_pair(session, y_id, x_id, hedge_ratio, zscore):
+    tracker = session.pair_tracker
+    k = tracker.pair_index(y_id, x_id)
+    tracker.hedge_ratio[:] = 1.0
+    tracker.cointegrated[:] = False
+    tracker.zscore[:] = 0.0
+    tracker.hedge_ratio[k] = hedge_ratio
+    tracker.cointegrated[k] = True
+    tracker.zscore[k] = zscore
+    return k
+
+
+def trade_pairs(session):
+    snapshot = session.market_data.snapshot()
+    stock_ids = session.registry.stock_ids
+    bids = np.array([snapshot[stock_id].best_bid for stock_id in stock_ids])
+    asks = np.array([snapshot[stock_id].best_ask for stock_id in stock_ids])
+    session.trade_pairs(bids, asks, snapshot)
+
+
+def test_negative_hedge_ratio_hedges_on_the_same_side():
+    exchange, session = pairs_session()
+    k = signal_pair(session, 'ING', 'SANTANDER', -0.6, 3.0)
+    trade_pairs(session)
+
+    strategy = pair_strategy('ING', 'SANTANDER')
+    y_position = session.ledger.strategy_position(strategy, 'ING')
+    x_position = session.ledger.strategy_position(strategy, 'SANTANDER')
+    # Short 20 ING at 20 is hedged by 0.6 * 20 * 20 / 40 = 6 SANTANDER at 40, also short
+    assert y_position == -20
+    assert x_position == -6
+    positions = exchange.get_positions()
+    assert (positions['ING'], positions['SANTANDER']) == (-20, -6)
+    # Both legs are short, which is a hedged spread for this pair, so it keeps them
+    assert k in session.open_pairs
+
+
+def test_hedge_ratio_near_zero_is_not_traded():
+    exchange, session = pairs_session()
+    signal_pair(session, 'ING', 'BAYER', 0.007, 3.0)
+    messages = exchange.message_count
+    trade_pairs(session)
+    assert exchange.message_count == messages
+    assert not session.open_pairs
@@ -0,0 +1,72 @@
+import datetime as dt
+
+import numpy as np
+
+from portfolio_greeks import PortfolioGreeks
+from position_ledger import PositionLedger
+from simulated_exchange import BookSnapshot, SimulatedExchange, Trade
+
+START = dt.datetime(2022, 3, 1, 9, 0, 0)
+
+UNDERLYINGS = ['A', 'B']
+OPTIONS = ['A-C', 'A-P', 'B-C']
+UNDERLYING_INDEX = [0, 0, 1]
+SPOTS = np.array([100.0, 50.0])
+DELTAS = np.array([0.5, -0.4, 0.6])
+GAMMAS = np.array([0.02, 0.03, 0.05])
+
+
+def priced_greeks(positions=(10, -5, 0)):
+    greeks = PortfolioGreeks(UNDERLYINGS, OPTIONS, UNDERLYING_INDEX)
+    greeks.reprice(SPOTS, DELTAS, GAMMAS, positions)
+    return greeks
+
+
+def test_reprice_totals_per_underlying():
+    greeks = priced_greeks()
+    np.testing.assert_allclose(greeks.delta, [10 * 0.5 + 5 * 0.4, 0])
+    np.testing.assert_allclose(greeks.gamma, [10 * 0.02 - 5 * 0.03, 0])
+
+
+def test_fills_between_reprices_match_a_full_reprice():
+    greeks = priced_greeks()
+    greeks.on_fill(Trade(1, 'A-P', 1.0, 3, 'ask'))
+    greeks.on_fill(Trade(2, 'B-C', 1.0, 4, 'bid'))
+    greeks.on_fill(Trade(3, 'A', 100.0, 7, 'bid'))
+
+    repriced = priced_greeks((10, -8, 4))
+    np.testing.assert_allclose(greeks.delta, repriced.delta)
+    np.testing.assert_allclose(greeks.gamma, repriced.gamma)
+    np.testing.assert_array_equal(greeks.option_positions, [10, -8, 4])
+
+
+def test_net_delta_follows_the_spot_through_gamma_and_adds_hedges():
+    greeks = priced_greeks()
+    spots = SPOTS + [2.0, -1.0]
+    stock_positions = np.array([-3, 0])
+    np.testing.assert_allclose(greeks.net_delta(spots, stock_positions),
+                               greeks.delta + greeks.gamma * [2.0, -1.0] + stock_positions)
+    np.testing.assert_allclose(greeks.net_delta(SPOTS, 0), greeks.delta)
+
+
+def test_unpriced_option_only_matters_once_held():
+    greeks = PortfolioGreeks(UNDERLYINGS, OPTIONS, UNDERLYING_INDEX)
+    greeks.reprice(SPOTS, [0.5, -0.4, np.nan], [0.02, 0.03, np.nan], [10, 0, 0])
+    assert np.isfinite(greeks.net_delta(SPOTS, 0)).all()
+    greeks.on_fill(Trade(1, 'B-C', 1.0, 1, 'bid'))
+    assert np.isnan(greeks.net_delta(SPOTS, 0)[1])
+    assert np.isfinite(greeks.net_delta(SPOTS, 0)[0])
+
+
+def test_ledger_fills_reach_the_greeks():
+    exchange = SimulatedExchange([BookSnapshot(START, {'A-C': ([(4.0, 50)], [(5.0, 50)])})], ['A', 'B'] + OPTIONS)
+    exchange.advance()
+    ledger = PositionLedger(exchange, ['A', 'B'] + OPTIONS, default_strategy='quoter', clock=exchange.monotonic)
+    ledger.seed()
+    greeks = priced_greeks((0, 0, 0))
+    ledger.add_listener(greeks.on_fill)
+
+    exchange.insert_order('A-C', price=5.0, volume=6, side='bid', order_type='ioc')
+    ledger.poll_fills()
+    np.testing.assert_allclose(greeks.delta, [6 * 0.5, 0])
+    np.testing.assert_allclose(greeks.gamma, [6 * 0.02, 0])
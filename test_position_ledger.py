@@ -0,0 +1,36 @@
+import datetime as dt
+
+from position_ledger import PositionLedger
+from simulated_exchange import BookSnapshot, SimulatedExchange
+
+START = dt.datetime(2022, 3, 1, 9, 0, 0)
+
+
+def seeded_ledger():
+    exchange = SimulatedExchange([BookSnapshot(START, {'X': ([(9.0, 50)], [(10.0, 50)])})], ['X'])
+    exchange.advance()
+    ledger = PositionLedger(exchange, ['X'], default_strategy='quoter', clock=exchange.monotonic)
+    ledger.seed()
+    return exchange, ledger
+
+
+def test_unpolled_fill_is_not_booked_as_drift():
+    exchange, ledger = seeded_ledger()
+    exchange.insert_order('X', price=10.0, volume=5, side='bid', order_type='ioc')
+    ledger.reconcile()
+    assert ledger.position('X') == 0
+    ledger.poll_fills()
+    ledger.reconcile()
+    assert ledger.position('X') == 5
+
+
+def test_drift_seen_twice_is_corrected():
+    exchange, ledger = seeded_ledger()
+    exchange.insert_order('X', price=10.0, volume=5, side='bid', order_type='ioc')
+    exchange.poll_new_trades('X')
+    ledger.reconcile()
+    assert ledger.position('X') == 0
+    exchange.sleep(ledger.drift_confirm_interval)
+    ledger.maybe_reconcile()
+    assert ledger.position('X') == 5
+    assert ledger.strategy_position('quoter', 'X') == 5
@@ -0,0 +1,126 @@
+import datetime as dt
+import threading
+
+from async_exchange import AsyncExchange
+from order_gateway import OrderGateway, TokenBucket
+from order_router import OrderRouter
+from position_ledger import PositionLedger
+from quote_manager import QuoteManager
+from simulated_exchange import BookSnapshot, SimulatedExchange
+
+START = dt.datetime(2022, 3, 1, 9, 0, 0)
+
+
+class NoGrowExchange(SimulatedExchange):
+    """Refuses to amend an order to a larger volume, as some exchanges do."""
+
+    def amend_order(self, instrument_id, *, order_id, volume):
+        entry = self._orders.get(order_id)
+        if entry is not None and volume > entry[0].volume:
+            self.message_count += 1
+            return False
+        return super().amend_order(instrument_id, order_id=order_id, volume=volume)
+
+
+class ArrivalOrderExchange(SimulatedExchange):
+    """Remembers the (instrument_id, side) of every insert in the order they arrive, from any thread."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.inserts = []
+        self._lock = threading.Lock()
+
+    def insert_order(self, instrument_id, **order):
+        with self._lock:
+            self.inserts.append((instrument_id, order['side']))
+            return super().insert_order(instrument_id, **order)
+
+
+class SteppedClock:
+    """Bucket time that only moves when the test says so. Every sleep() blocks until release_next() wakes the
+    sleepers one at a time, oldest first, so the test decides who gets to look at the bucket when."""
+
+    def __init__(self):
+        self.now = 0.0
+        self._sleepers = []
+        self._condition = threading.Condition()
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        woken = threading.Event()
+        with self._condition:
+            self._sleepers.append(woken)
+            self._condition.notify_all()
+        woken.wait()
+
+    def wait_for_sleepers(self, count, timeout=1.0):
+        with self._condition:
+            return self._condition.wait_for(lambda: len(self._sleepers) >= count, timeout)
+
+    def release_next(self, seconds, settle=0.05):
+        """Move time on by seconds and wake the oldest sleeper, then give it settle seconds to either go back to
+        sleep or get on with its work before anyone else is woken."""
+        with self._condition:
+            self.now += seconds
+            self._sleepers.pop(0).set()
+            asleep = len(self._sleepers)
+            self._condition.wait_for(lambda: len(self._sleepers) > asleep, settle)
+
+
+def batched_quote_manager(exchange, bucket=None):
+    exchange.advance()
+    if bucket is None:
+        bucket = TokenBucket(rate=1000, capacity=1000, clock=exchange.monotonic, sleep=exchange.sleep)
+    gateway = OrderGateway(exchange, bucket)
+    ledger = PositionLedger(exchange, ['X', 'Y'], default_strategy='quoter', clock=exchange.monotonic)
+    ledger.seed()
+    async_exchange = AsyncExchange(lambda: exchange, connections=1, bucket=gateway.quote_bucket)
+    router = OrderRouter(gateway, ledger, async_exchange)
+    return QuoteManager(router, 'quoter'), gateway, async_exchange
+
+
+def test_rejected_batch_amend_cancels_the_old_order():
+    exchange = NoGrowExchange([BookSnapshot(START, {'X': ([(8.0, 10)], [(12.0, 10)])})], ['X'])
+    quote_manager, _, async_exchange = batched_quote_manager(exchange)
+    try:
+        quote_manager.update_all([('X', 9.0, 11.0, 5)])
+        quote_manager.update_all([('X', 9.0, 11.0, 10)])
+    finally:
+        async_exchange.close()
+
+    outstanding = exchange.get_outstanding_orders('X').values()
+    assert sorted((order.side, order.volume) for order in outstanding) == [('ask', 10), ('bid', 10)]
+    assert {quote_manager.live_quote('X', side).order_id for side in ('bid', 'ask')} == {order.order_id for order in outstanding}
+
+
+def test_waiting_hedge_goes_out_before_a_waiting_batch_of_quotes():
+    exchange = ArrivalOrderExchange([BookSnapshot(START, {'X': ([(8.0, 10)], [(12.0, 10)]),
+                                                          'Y': ([(19.0, 10)], [(21.0, 10)])})], ['X', 'Y'])
+    clock = SteppedClock()
+    bucket = TokenBucket(rate=10, capacity=1, clock=clock, sleep=clock.sleep)
+    quote_manager, gateway, async_exchange = batched_quote_manager(exchange, bucket)
+    assert bucket.try_acquire()
+
+    # Both quotes of the batch wait for a token first, then the hedge joins them
+    batch = threading.Thread(target=quote_manager.update_all, args=([('X', 9.0, 11.0, 5)],))
+    batch.start()
+    assert clock.wait_for_sleepers(2)
+    hedge = threading.Thread(target=gateway.insert_order, kwargs=dict(
+        instrument_id='Y', price=21.0, volume=5, side='bid', order_type='ioc'))
+    hedge.start()
+    assert clock.wait_for_sleepers(3)
+
+    # One token's worth of time per wake-up, offered to the longest sleeper first
+    try:
+        while batch.is_alive() or hedge.is_alive():
+            if clock.wait_for_sleepers(1, timeout=0.05):
+                clock.release_next(1 / bucket.rate)
+    finally:
+        batch.join()
+        hedge.join()
+        async_exchange.close()
+
+    assert exchange.inserts[0] == ('Y', 'bid')
+    assert sorted(exchange.inserts[1:]) == [('X', 'ask'), ('X', 'bid')]
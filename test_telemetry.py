@@ -0,0 +1,52 @@
+import numpy as np
+
+from telemetry import LatencyHistogram, SUB_BUCKET_BITS, _EXACT_LIMIT
+
+
+def test_small_values_are_exact():
+    for value in range(_EXACT_LIMIT):
+        index = LatencyHistogram._index(value)
+        assert index == value
+        assert LatencyHistogram._lower_bound(index) == value
+
+
+def test_every_value_falls_in_its_bucket_within_relative_precision():
+    values = np.unique(np.concatenate([np.arange(_EXACT_LIMIT, 4096),
+                                       np.geomspace(4096, 2 ** 45, 5000).astype(np.int64)]))
+    previous_index = LatencyHistogram._index(_EXACT_LIMIT - 1)
+    for value in map(int, values):
+        index = LatencyHistogram._index(value)
+        lower = LatencyHistogram._lower_bound(index)
+        upper = LatencyHistogram._lower_bound(index + 1)
+        assert lower <= value < upper
+        assert (upper - lower) / lower <= 2.0 ** -SUB_BUCKET_BITS
+        # Indices grow with the value, without gaps between neighbouring buckets
+        assert previous_index <= index
+        previous_index = index
+
+
+def test_bucket_boundaries_are_contiguous():
+    for index in range(_EXACT_LIMIT - 1, _EXACT_LIMIT + 10 * (1 << SUB_BUCKET_BITS)):
+        upper = LatencyHistogram._lower_bound(index + 1)
+        assert LatencyHistogram._index(upper - 1) == index
+        assert LatencyHistogram._index(upper) == index + 1
+
+
+def test_percentiles():
+    histogram = LatencyHistogram()
+    for value in range(1, 1001):
+        histogram.record(value * 1000)
+    assert histogram.count == 1000
+    assert histogram.max == 1_000_000
+    for percentile, expected in ((50, 500_000), (99, 990_000), (100, 1_000_000)):
+        assert expected * (1 - 2.0 ** -SUB_BUCKET_BITS) <= histogram.percentile(percentile) <= expected
+
+
+def test_out_of_range_values_are_clamped():
+    histogram = LatencyHistogram()
+    histogram.record(-5)
+    histogram.record(2 ** 62)
+    assert histogram.counts[0] == 1
+    assert histogram.counts[-1] == 1
+    assert histogram.percentile(50) == 0
+    assert histogram.percentile(100) == LatencyHistogram._lower_bound(len(histogram.counts) - 1)
@@ -0,0 +1,57 @@
+import datetime as dt
+
+import numpy as np
+
+from backtest import run_backtest, synthetic_book_stream
+from Code import TradingSession, RECORDING_BOOK_LEVELS
+from simulated_exchange import SimulatedExchange
+from tick_recorder import TickRecorder, read_books, read_events, recorded_book_stream, EVENT_KINDS
+
+START = dt.datetime(2022, 3, 1, 9, 0, 0)
+START_NS = int(START.replace(tzinfo=dt.timezone.utc).timestamp()) * 10**9
+DAY = '2022-03-01'
+STEPS = 30
+
+
+def record_session(root):
+    """Run the strategy over a synthetic session with a recorder attached, on the simulated clock."""
+    synthetic = list(synthetic_book_stream(START, STEPS))
+    exchange = SimulatedExchange(iter(synthetic))
+    exchange.advance()
+    recorder = TickRecorder(root, clock=lambda: START_NS + int(round(exchange.monotonic() * 1e9)),
+                            book_levels=RECORDING_BOOK_LEVELS)
+    recorder.start()
+    session = TradingSession(exchange, exchange, now=exchange.now, clock=exchange.monotonic, sleep=exchange.sleep,
+                             recorder=recorder)
+    while True:
+        session.market_data.poll_once()
+        session.run_iteration()
+        if not exchange.advance():
+            break
+    recorder.stop()
+    return synthetic, session
+
+
+def test_recorded_day_replays_without_our_own_quotes(tmp_path):
+    synthetic, session = record_session(str(tmp_path))
+    option_id = session.registry.option_ids[0]
+
+    books = read_books(str(tmp_path), DAY, option_id, RECORDING_BOOK_LEVELS)
+    events = read_events(str(tmp_path), DAY, option_id)
+    assert len(books) > 0
+    assert (events['kind'] == EVENT_KINDS['insert']).any()
+    assert session.quote_manager.live_quote(option_id, 'bid') is not None
+
+    # Every replayed book is the market's own ladder from the session it was recorded from, without our quotes
+    replayed = list(recorded_book_stream(str(tmp_path), DAY, session.registry.instrument_ids,
+                                         RECORDING_BOOK_LEVELS))
+    assert len(replayed) >= STEPS
+    for snapshot in replayed:
+        market = max((s for s in synthetic if s.timestamp <= snapshot.timestamp), key=lambda s: s.timestamp)
+        for instrument_id in session.registry.option_ids:
+            if instrument_id in snapshot.books:
+                for replayed_levels, market_levels in zip(snapshot.books[instrument_id], market.books[instrument_id]):
+                    np.testing.assert_allclose(np.reshape(replayed_levels, (-1, 2)), np.reshape(market_levels, (-1, 2)))
+
+    results = run_backtest(iter(replayed))
+    assert results['iterations'] == len(replayed)
@@ -0,0 +1,32 @@
+import numpy as np
+
+from option_pricing import black_scholes_chain
+from volatility_surface import VolatilitySurface
+
+UNDERLYING_INDEX = np.repeat([0, 1], 4)
+DEFAULT_VOLATILITY = np.array([0.2, 0.3])
+S = np.array([100.0, 50.0])[UNDERLYING_INDEX]
+K = np.array([90.0, 95.0, 105.0, 110.0, 45.0, 48.0, 52.0, 55.0])
+T = np.full(8, 0.25)
+IS_CALL = np.tile([True, False], 4)
+
+
+def test_tick_without_any_quotes_keeps_the_default_smile():
+    surface = VolatilitySurface(UNDERLYING_INDEX, DEFAULT_VOLATILITY)
+    sigma = surface.update(np.full(8, np.nan), S, K, T, IS_CALL)
+    np.testing.assert_allclose(sigma, DEFAULT_VOLATILITY[UNDERLYING_INDEX])
+
+
+def test_underlyings_with_too_few_quotes_keep_their_previous_smile():
+    surface = VolatilitySurface(UNDERLYING_INDEX, DEFAULT_VOLATILITY, min_quotes=3)
+    mids = black_scholes_chain(S, K, T, 0, np.full(8, 0.4), IS_CALL)[0]
+    mids[[2, 3, 6, 7]] = np.nan
+    sigma = surface.update(mids, S, K, T, IS_CALL)
+    np.testing.assert_allclose(sigma, DEFAULT_VOLATILITY[UNDERLYING_INDEX])
+
+
+def test_flat_market_is_fitted_flat():
+    surface = VolatilitySurface(UNDERLYING_INDEX, DEFAULT_VOLATILITY)
+    mids = black_scholes_chain(S, K, T, 0, np.full(8, 0.4), IS_CALL)[0]
+    sigma = surface.update(mids, S, K, T, IS_CALL)
+    np.testing.assert_allclose(sigma, 0.4, atol=1e-3)
@@ -0,0 +1,275 @@
+import datetime as dt
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from market_data import PRICE_TOLERANCE
+from simulated_exchange import BookSnapshot
+
+logger = logging.getLogger(__name__)
+
+# Default depth of a book record; a recording must be read back with the depth it was written with
+BOOK_LEVELS = 5
+
+
+def book_dtype(levels):
+    """Record layout of one book snapshot holding up to levels price levels per side."""
+    return np.dtype([
+        ('timestamp', '<i8'),
+        ('sequence', '<i8'),
+        ('bid_price', '<f8', (levels,)),
+        ('bid_volume', '<i8', (levels,)),
+        ('ask_price', '<f8', (levels,)),
+        ('ask_volume', '<i8', (levels,)),
+    ])
+
+
+BOOK_DTYPE = book_dtype(BOOK_LEVELS)
+
+EVENT_DTYPE = np.dtype([
+    ('timestamp', '<i8'),
+    ('kind', 'u1'),
+    ('side', 'i1'),
+    ('order_id', '<i8'),
+    ('price', '<f8'),
+    ('volume', '<i8'),
+])
+
+# An insert is recorded as 'ioc' if it could never rest, so a replay knows it was never in the book
+EVENT_KINDS = {'insert': 1, 'delete': 2, 'amend': 3, 'fill': 4, 'ioc': 5}
+SIDES = {'bid': 1, 'ask': -1, None: 0}
+
+BOOKS_SUFFIX = '.books'
+EVENTS_SUFFIX = '.events'
+
+_STOP = object()
+
+
+def _day(timestamp_ns):
+    return dt.datetime.fromtimestamp(timestamp_ns / 1e9, dt.timezone.utc).strftime('%Y-%m-%d')
+
+
+def _path(root, day, instrument_id, suffix):
+    return os.path.join(root, day, instrument_id + suffix)
+
+
+def _book_records(entries, levels):
+    records = np.zeros(len(entries), dtype=book_dtype(levels))
+    records['bid_price'] = np.nan
+    records['ask_price'] = np.nan
+    for row, (timestamp_ns, book) in enumerate(entries):
+        records['timestamp'][row] = timestamp_ns
+        records['sequence'][row] = book.sequence
+        for level_index, level in enumerate(book.bids[:levels]):
+            records['bid_price'][row, level_index] = level.price
+            records['bid_volume'][row, level_index] = level.volume
+        for level_index, level in enumerate(book.asks[:levels]):
+            records['ask_price'][row, level_index] = level.price
+            records['ask_volume'][row, level_index] = level.volume
+    return records
+
+
+class TickRecorder:
+    """Appends book snapshots and our own order/fill events to fixed-width binary files.
+
+    Files live at <root>/<YYYY-MM-DD>/<instrument_id>.books and .events, one book_dtype(book_levels) or
+    EVENT_DTYPE record after another, so they can be memory-mapped straight back into NumPy. Levels beyond
+    book_levels are not recorded; a warning is logged the first time an instrument's book is cut. The on_*
+    callbacks only timestamp and enqueue; all encoding and disk I/O happen on the writer thread.
+    """
+
+    def __init__(self, root, clock=time.time_ns, batch_size=1024, book_levels=BOOK_LEVELS):
+        self.root = root
+        self.batch_size = batch_size
+        self.book_levels = book_levels
+        self._clock = clock
+        self._queue = queue.SimpleQueue()
+        self._files = {}
+        self._truncated = set()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='tick-recorder', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Flush everything still queued and close the files."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    # Producer side, called from the trading and feed threads
+
+    def on_book(self, book):
+        self._queue.put(('book', self._clock(), book))
+
+    def on_order(self, kind, instrument_id, order_id, side=None, price=np.nan, volume=0, order_type=None):
+        if kind == 'insert' and order_type == 'ioc':
+            kind = 'ioc'
+        self._queue.put(('event', self._clock(), (instrument_id, EVENT_KINDS[kind], SIDES[side], order_id, price, volume)))
+
+    def on_fill(self, trade):
+        self._queue.put(('event', self._clock(),
+                         (trade.instrument_id, EVENT_KINDS['fill'], SIDES[trade.side], trade.order_id, trade.price, trade.volume)))
+
+    # Writer side
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is _STOP:
+                batch.pop()
+                stopping = True
+            try:
+                self._write(batch)
+            except Exception:
+                logger.exception('Failed to write recorded ticks.')
+        for handle in self._files.values():
+            handle.close()
+        self._files.clear()
+
+    def _write(self, batch):
+        books = {}
+        events = {}
+        for kind, timestamp_ns, payload in batch:
+            if kind == 'book':
+                books.setdefault((_day(timestamp_ns), payload.instrument_id), []).append((timestamp_ns, payload))
+            else:
+                events.setdefault((_day(timestamp_ns), payload[0]), []).append((timestamp_ns,) + payload[1:])
+
+        for (day, instrument_id), entries in books.items():
+            if instrument_id not in self._truncated and any(
+                    max(len(book.bids), len(book.asks)) > self.book_levels for _, book in entries):
+                self._truncated.add(instrument_id)
+                logger.warning('Recording only the top %d levels of the %s book.', self.book_levels, instrument_id)
+            self._file(day, instrument_id, BOOKS_SUFFIX).write(_book_records(entries, self.book_levels).tobytes())
+
+        for (day, instrument_id), entries in events.items():
+            records = np.array(entries, dtype=EVENT_DTYPE)
+            self._file(day, instrument_id, EVENTS_SUFFIX).write(records.tobytes())
+
+        for handle in self._files.values():
+            handle.flush()
+
+    def _file(self, day, instrument_id, suffix):
+        key = (day, instrument_id, suffix)
+        handle = self._files.get(key)
+        if handle is None:
+            os.makedirs(os.path.join(self.root, day), exist_ok=True)
+            handle = self._files[key] = open(_path(self.root, day, instrument_id, suffix), 'ab')
+        return handle
+
+
+def _memmap(path, dtype):
+    if not os.path.exists(path) or os.path.getsize(path) < dtype.itemsize:
+        return np.empty(0, dtype=dtype)
+    # Ignore a trailing partial record from a writer that is still appending
+    count = os.path.getsize(path) // dtype.itemsize
+    return np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+
+def read_books(root, day, instrument_id, book_levels=BOOK_LEVELS):
+    """Zero-copy, read-only book_dtype(book_levels) view of one instrument's recorded books for a day."""
+    return _memmap(_path(root, day, instrument_id, BOOKS_SUFFIX), book_dtype(book_levels))
+
+
+def read_events(root, day, instrument_id):
+    """Zero-copy, read-only EVENT_DTYPE view of our recorded orders and fills on one instrument for a day."""
+    return _memmap(_path(root, day, instrument_id, EVENTS_SUFFIX), EVENT_DTYPE)
+
+
+def _apply_event(resting, event):
+    """Bring resting, {order_id: [side, price, volume]} of our orders in the book, up to date with one event."""
+    kind = event['kind']
+    order_id = int(event['order_id'])
+    if kind == EVENT_KINDS['insert']:
+        resting[order_id] = [int(event['side']), float(event['price']), int(event['volume'])]
+    elif kind == EVENT_KINDS['delete']:
+        resting.pop(order_id, None)
+    elif order_id in resting:
+        if kind == EVENT_KINDS['amend']:
+            resting[order_id][2] = int(event['volume'])
+        elif kind == EVENT_KINDS['fill']:
+            resting[order_id][2] -= int(event['volume'])
+        if resting[order_id][2] <= 0:
+            del resting[order_id]
+
+
+def _market_levels(prices, volumes, own_orders):
+    """Recorded levels less our own resting volume at each price, as (price, volume) pairs; emptied levels are dropped.
+
+    Adjacent levels closer than PRICE_TOLERANCE are merged first, so an order is only ever taken out once.
+    """
+    levels = []
+    for price, volume in zip(prices, volumes):
+        if volume <= 0:
+            continue
+        if levels and abs(levels[-1][0] - price) < PRICE_TOLERANCE:
+            levels[-1][1] += int(volume)
+        else:
+            levels.append([float(price), int(volume)])
+    for price, volume in own_orders:
+        for level in levels:
+            if abs(level[0] - price) < PRICE_TOLERANCE:
+                level[1] -= volume
+                break
+    return [(price, volume) for price, volume in levels if volume > 0]
+
+
+def recorded_book_stream(root, day, instrument_ids, book_levels=BOOK_LEVELS):
+    """Merge the recorded books of instrument_ids into time-ordered BookSnapshots for a SimulatedExchange.
+
+    The live feed saw our own quotes in the books, so the orders we had resting at each instant, rebuilt from
+    the recorded events, are taken out again: a replay trades against the rest of the market only. Snapshot
+    times are naive UTC, like the expiries the strategy compares them with.
+    """
+    recordings = {instrument_id: read_books(root, day, instrument_id, book_levels) for instrument_id in instrument_ids}
+    events = {instrument_id: read_events(root, day, instrument_id) for instrument_id in instrument_ids}
+    timestamps = np.unique(np.concatenate([records['timestamp'] for records in recordings.values()]))
+    cursors = {instrument_id: 0 for instrument_id in instrument_ids}
+    event_cursors = {instrument_id: 0 for instrument_id in instrument_ids}
+    resting = {instrument_id: {} for instrument_id in instrument_ids}
+
+    for timestamp_ns in timestamps:
+        books = {}
+        for instrument_id, records in recordings.items():
+            cursor = cursors[instrument_id]
+            record = None
+            # Several records can share a timestamp; the last one is the book as of that instant
+            while cursor < len(records) and records['timestamp'][cursor] <= timestamp_ns:
+                record = records[cursor]
+                cursor += 1
+            cursors[instrument_id] = cursor
+
+            instrument_events = events[instrument_id]
+            event_cursor = event_cursors[instrument_id]
+            # A message stamped at the same instant as the book went out after the feed read it, so is not in it
+            while event_cursor < len(instrument_events) and instrument_events['timestamp'][event_cursor] < timestamp_ns:
+                _apply_event(resting[instrument_id], instrument_events[event_cursor])
+                event_cursor += 1
+            event_cursors[instrument_id] = event_cursor
+
+            if record is not None:
+                orders = resting[instrument_id].values()
+                books[instrument_id] = (
+                    _market_levels(record['bid_price'], record['bid_volume'],
+                                   [(price, volume) for side, price, volume in orders if side == SIDES['bid']]),
+                    _market_levels(record['ask_price'], record['ask_volume'],
+                                   [(price, volume) for side, price, volume in orders if side == SIDES['ask']]),
+                )
+        timestamp = dt.datetime.fromtimestamp(timestamp_ns / 1e9, dt.timezone.utc).replace(tzinfo=None)
+        yield BookSnapshot(timestamp, books)
@@ -0,0 +1,63 @@
+import numpy as np
+
+from option_pricing import implied_volatility_chain
+
+SMILE_DEGREE = 2
+MIN_VOLATILITY = 1e-3
+
+
+class VolatilitySurface:
+    """Per-underlying volatility smile fitted to the implied volatilities of the market's option mids.
+
+    Every update() solves implied volatility for the whole chain in one vectorized call, warm-started from the
+    previous tick's solution, and fits sigma(k) = a + b*k + c*k^2 in log-moneyness k = log(K / S) for each
+    underlying by ridge-regularized least squares, again for all underlyings at once. An underlying with too
+    few usable quotes keeps its previous smile, which starts out flat at its default volatility.
+    """
+
+    def __init__(self, underlying_index, default_volatility, ridge=1e-4, min_quotes=3):
+        self.underlying_index = np.asarray(underlying_index, dtype=np.intp)
+        self.underlying_count = len(default_volatility)
+        self.ridge = ridge
+        self.min_quotes = min_quotes
+
+        self.coefficients = np.zeros((self.underlying_count, SMILE_DEGREE + 1))
+        self.coefficients[:, 0] = default_volatility
+        self.implied = np.full(len(self.underlying_index), np.nan)
+
+    def update(self, option_mids, S, K, T, is_call):
+        """Re-solve and re-fit from this tick's option mids (NaN where unquoted). Returns the smile vol per option."""
+        log_moneyness = np.log(np.asarray(K, dtype=float) / np.asarray(S, dtype=float))
+        initial_sigma = np.where(np.isfinite(self.implied), self.implied, self.evaluate(log_moneyness))
+        self.implied = implied_volatility_chain(option_mids, S, K, T, 0, is_call, initial_sigma)
+        self._fit(log_moneyness, self.implied)
+        return self.evaluate(log_moneyness)
+
+    def evaluate(self, log_moneyness):
+        coefficients = self.coefficients[self.underlying_index]
+        powers = np.power.outer(log_moneyness, np.arange(SMILE_DEGREE + 1))
+        return np.maximum(np.einsum('ij,ij->i', coefficients, powers), MIN_VOLATILITY)
+
+    def _fit(self, log_moneyness, implied):
+        usable = np.isfinite(implied) & np.isfinite(log_moneyness)
+        groups = self.underlying_index[usable]
+        k = log_moneyness[usable]
+        vols = implied[usable]
+
+        # Normal equations for every underlying at once: A[g] = sum k^(i+j), b[g] = sum k^i * sigma
+        degree = SMILE_DEGREE
+        powers = np.power.outer(k, np.arange(2 * degree + 1))
+        # bincount of an empty selection is integer, so cast or the ridge below cannot be added in place
+        moments = np.column_stack([np.bincount(groups, powers[:, i], self.underlying_count)
+                                   for i in range(2 * degree + 1)]).astype(float)
+        targets = np.column_stack([np.bincount(groups, powers[:, i] * vols, self.underlying_count)
+                                   for i in range(degree + 1)]).astype(float)
+
+        exponents = np.add.outer(np.arange(degree + 1), np.arange(degree + 1))
+        normal = moments[:, exponents]
+        # Penalise slope and curvature only, so sparse or noisy quotes flatten the smile rather than bend it
+        normal[:, np.arange(1, degree + 1), np.arange(1, degree + 1)] += self.ridge
+
+        enough = moments[:, 0] >= self.min_quotes
+        if enough.any():
+            self.coefficients[enough] = np.linalg.solve(normal[enough], targets[enough][..., None])[..., 0]